@@ -1,21 +1,165 @@
 """Routines to deal with the Python assert statement."""
 
+import ast
 import bdb
 import dis
+import marshal
 import operator
+import os
 import re
+import sys
 import types
+from struct import Struct
 from sys import version_info
 from types import FunctionType
 from .compatibility import get_code, set_code, unittest
 
+try:
+    from reprlib import Repr
+except ImportError:
+    from repr import Repr
+
 _case = unittest.TestCase('setUp')
-_case.maxDiff = 2048  # TODO: people should be able to customize this
+_case.maxDiff = 2048
 _python_version = version_info[:2]
+
+# Comparing values whose length exceeds the maxDiff above with difflib
+# could take minutes, so they are instead compared here in linear time,
+# with only a window around their first difference displayed.
+DIFF_CONTEXT_ITEMS = 3
+DIFF_CONTEXT_CHARACTERS = 40
+EXAMPLE_COUNT = 3
+
+_string_types = (bytes, type(u''))
+_sized_types = _string_types + (list, tuple, dict, set, frozenset)
+
+_repr = Repr()
+_repr.maxlist = _repr.maxtuple = 2 * DIFF_CONTEXT_ITEMS + 1
+_repr.maxstring = _repr.maxother = 60
+short_repr = _repr.repr
+
+def set_max_diff(characters):
+    """Set the longest diff shown, and so the size of a huge value."""
+    _case.maxDiff = characters
+
+def is_huge(value):
+    """Return whether `value` is too big to diff or print in full.
+
+    Its size is estimated, at every depth, as the length of each string
+    plus the number of items in each container.  The estimate stops as
+    soon as it passes the limit, so it takes little time itself.
+
+    """
+    limit = _case.maxDiff
+    if limit is None:
+        return False
+    values = [value]
+    while values:
+        value = values.pop()
+        if isinstance(value, _sized_types):
+            limit -= len(value)
+            if limit < 0:
+                return True
+            if isinstance(value, dict):
+                values.extend(value)
+                values.extend(value.values())
+            elif not isinstance(value, _string_types):
+                values.extend(value)
+    return False
+
+def assert_equal(a, b):
+    """Like ``assertEqual()``, but quick to fail even for huge values."""
+    if not (is_huge(a) or is_huge(b)):
+        _case.assertEqual(a, b)
+    elif not a == b:
+        raise AssertionError(describe_inequality(a, b))
+
+def assert_in(member, container):
+    if not (is_huge(member) or is_huge(container)):
+        _case.assertIn(member, container)
+    elif member not in container:
+        raise AssertionError('{0} not found in {1}'.format(
+            short_repr(member), short_repr(container)))
+
+def assert_not_in(member, container):
+    if not (is_huge(member) or is_huge(container)):
+        _case.assertNotIn(member, container)
+    elif member in container:
+        raise AssertionError('{0} unexpectedly found in {1}'.format(
+            short_repr(member), short_repr(container)))
+
+def describe_inequality(a, b):
+    """Explain how two unequal values differ, in time linear in their size."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        return describe_dict_inequality(a, b)
+    if (isinstance(a, (set, frozenset)) and isinstance(b, (set, frozenset))):
+        return describe_set_inequality(a, b)
+    if (type(a) is type(b) and isinstance(a, (list, tuple))
+        or isinstance(a, _string_types) and isinstance(b, _string_types)):
+        return describe_sequence_inequality(a, b)
+    return '{0} != {1}'.format(short_repr(a), short_repr(b))
+
+def describe_sequence_inequality(a, b):
+    n = min(len(a), len(b))
+    if isinstance(a, _string_types):
+        i = common_prefix_length(a, b, n)
+        context = DIFF_CONTEXT_CHARACTERS
+        show = repr
+    else:
+        i = next((i for i in range(n) if not a[i] == b[i]), n)
+        context = DIFF_CONTEXT_ITEMS
+        show = short_repr
+    start = max(0, i - context)
+    end = i + context + 1
+    return ('{0} of lengths {1} and {2} first differ at index {3}:\n'
+            '  left[{4}:{5}] = {6}\n'
+            ' right[{4}:{5}] = {7}'.format(
+                type(a).__name__, len(a), len(b), i, start, end,
+                show(a[start:end]), show(b[start:end])))
+
+def common_prefix_length(a, b, n):
+    """Return how many leading characters `a` and `b` share, up to `n`."""
+    low, high = 0, n
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def describe_dict_inequality(a, b):
+    lines = ['Dicts of lengths {0} and {1} differ'.format(len(a), len(b))]
+    describe_keys(lines, 'keys only on the left',
+                  [k for k in a if k not in b])
+    describe_keys(lines, 'keys only on the right',
+                  [k for k in b if k not in a])
+    changed = [k for k in a if k in b and not a[k] == b[k]]
+    if changed:
+        lines.append('{0} keys with different values, including:'
+                     .format(len(changed)))
+        for key in changed[:EXAMPLE_COUNT]:
+            lines.append('  [{0}] {1} != {2}'.format(
+                short_repr(key), short_repr(a[key]), short_repr(b[key])))
+    return '\n'.join(lines)
+
+def describe_set_inequality(a, b):
+    lines = ['Sets of lengths {0} and {1} differ'.format(len(a), len(b))]
+    describe_keys(lines, 'items only on the left',
+                  [x for x in a if x not in b])
+    describe_keys(lines, 'items only on the right',
+                  [x for x in b if x not in a])
+    return '\n'.join(lines)
+
+def describe_keys(lines, where, keys):
+    if keys:
+        examples = ', '.join(short_repr(key) for key in keys[:EXAMPLE_COUNT])
+        lines.append('{0} {1}, like {2}'.format(len(keys), where, examples))
+
 fancy_comparisons = {
-    '==': _case.assertEqual,
-    'in': _case.assertIn,
-    'not in': _case.assertNotIn,
+    '==': assert_equal,
+    'in': assert_in,
+    'not in': assert_not_in,
     'is': _case.assertIs,
     'is not': _case.assertIsNot,
     }
@@ -35,7 +179,9 @@ def make_comparer(op):
         return fancy_comparisons[op]
     def compare(a, b):
         if not test(a, b):
-            message = '{0!r}\n{1:>15} {2!r}'.format(a, 'is not ' + op, b)
+            message = '{0}\n{1:>15} {2}'.format(
+                short_repr(a) if is_huge(a) else repr(a), 'is not ' + op,
+                short_repr(b) if is_huge(b) else repr(b))
             raise AssertionError(message)
     test = plain_comparisons[op]
     return compare
@@ -63,64 +209,81 @@ def assemble_pattern(things):
 
 # How an "assert" statement looks in each version of Python.
 
-if _python_version <= (2,6):
-
-    assert_pattern_text = assemble_pattern([
-        op.compare_op, b'(.)', 0,
-        op.jump_if_true, b'..',
-        op.pop_top,
-        op.load_global, b'(..)',
-        op.raise_varargs, 1, 0,
-        op.pop_top,
-        ])
-
-    replacement = assemble_replacement([
-        op.load_const, b'%%',   # stack: ... op1 op2 function
-        op.rot_three,           # stack: ... function op1 op2
-        op.call_function, 2, 0, # stack: ... return_value
-        op.nop, op.nop, op.nop, op.nop, op.nop, op.nop,
-        op.pop_top,             # stack: ...
-        ])
-
-elif _python_version <= (3,5):
-
-    assert_pattern_text = assemble_pattern([
-        op.compare_op, b'(.)', 0,
-        op.pop_jump_if_true, b'..',
-        op.load_global, b'(..)',
-        op.raise_varargs, 1, 0,
-        ])
-
-    replacement = assemble_replacement([
-        op.load_const, b'%%',   # stack: ... op1 op2 function
-        op.rot_three,           # stack: ... function op1 op2
-        op.call_function, 2, 0, # stack: ... return_value
-        op.pop_top,             # stack: ...
-        op.nop, op.nop, op.nop, op.nop,
-        ])
-
-else:
-
-    assert_pattern_text = assemble_pattern([
-        op.compare_op, b'(.)',
-        op.pop_jump_if_true, b'.',
-        op.load_global, b'(.)',
-        op.raise_varargs, 1,
-        ])
-
-    replacement = assemble_replacement([
-        op.load_const, b'%%',   # stack: ... op1 op2 function
-        op.rot_three, 0,        # stack: ... function op1 op2
-        op.call_function, 2,    # stack: ... return_value
-        op.pop_top, 0,          # stack: ...
-        ])
-
-# Note that "re.S" is crucial when compiling this pattern, as a byte we
-# are trying to match with "." might happen to have the numeric value of
-# an ASCII newline.
-assert_pattern = re.compile(assert_pattern_text, re.S)
+def assemble_bytecode_tables():
+    """Return a pattern matching an assert's bytecode, and its replacement.
+
+    Returns None under Python 3.11 and later, whose bytecode no longer
+    has a layout that can be patched in place, and whose failed asserts
+    can only explain themselves if their module was rewritten on import.
+
+    """
+    if _python_version >= (3,11):
+        return None
+
+    if _python_version <= (2,6):
+
+        assert_pattern_text = assemble_pattern([
+            op.compare_op, b'(.)', 0,
+            op.jump_if_true, b'..',
+            op.pop_top,
+            op.load_global, b'(..)',
+            op.raise_varargs, 1, 0,
+            op.pop_top,
+            ])
+
+        replacement = assemble_replacement([
+            op.load_const, b'%%',   # stack: ... op1 op2 function
+            op.rot_three,           # stack: ... function op1 op2
+            op.call_function, 2, 0, # stack: ... return_value
+            op.nop, op.nop, op.nop, op.nop, op.nop, op.nop,
+            op.pop_top,             # stack: ...
+            ])
+
+    elif _python_version <= (3,5):
+
+        assert_pattern_text = assemble_pattern([
+            op.compare_op, b'(.)', 0,
+            op.pop_jump_if_true, b'..',
+            op.load_global, b'(..)',
+            op.raise_varargs, 1, 0,
+            ])
+
+        replacement = assemble_replacement([
+            op.load_const, b'%%',   # stack: ... op1 op2 function
+            op.rot_three,           # stack: ... function op1 op2
+            op.call_function, 2, 0, # stack: ... return_value
+            op.pop_top,             # stack: ...
+            op.nop, op.nop, op.nop, op.nop,
+            ])
+
+    else:
+
+        assert_pattern_text = assemble_pattern([
+            op.compare_op, b'(.)',
+            op.pop_jump_if_true, b'.',
+            op.load_global, b'(.)',
+            op.raise_varargs, 1,
+            ])
+
+        replacement = assemble_replacement([
+            op.load_const, b'%%',   # stack: ... op1 op2 function
+            op.rot_three, 0,        # stack: ... function op1 op2
+            op.call_function, 2,    # stack: ... return_value
+            op.pop_top, 0,          # stack: ...
+            ])
+
+    # Note that "re.S" is crucial when compiling this pattern, as a byte
+    # we are trying to match with "." might happen to have the numeric
+    # value of an ASCII newline.
+    return re.compile(assert_pattern_text, re.S), replacement
+
+bytecode_tables = assemble_bytecode_tables()
 
 def rewrite_asserts_in(function):
+    """Make the asserts in `function` explain their failures, if we can."""
+    if bytecode_tables is None:
+        return
+    assert_pattern, replacement = bytecode_tables
 
     def replace(match):
         match.group(2) # TODO: make sure this is the right symbol
@@ -163,6 +326,157 @@ def rewrite_asserts_in(function):
         code_object = types.CodeType(*args)
     set_code(function, code_object)
 
+# Under Python 3, test modules are instead rewritten as they are imported,
+# so that each assert that compares two values can explain its failure
+# the first time it fails.  The statement ``assert a == b`` becomes:
+#
+#     if __debug__:
+#         @assay_left = a
+#         @assay_right = b
+#         if not (@assay_left == @assay_right):
+#             raise AssertionError(@assay_explain('==', @assay_left,
+#                                                 @assay_right))
+#
+# The odd names cannot collide with any name in the module's own code.
+
+EXPLAIN = '@assay_explain'
+REWRITE_VERSION = 1
+
+_symbols = {
+    ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=',
+    ast.Gt: '>', ast.GtE: '>=', ast.In: 'in', ast.NotIn: 'not in',
+    ast.Is: 'is', ast.IsNot: 'is not',
+    }
+_comparers = dict((symbol, make_comparer(symbol))
+                  for symbol in _symbols.values())
+
+def explain(symbol, a, b):
+    """Return a message saying why ``a <symbol> b`` was false."""
+    try:
+        _comparers[symbol](a, b)
+    except AssertionError as e:
+        return str(e)
+    return '{0!r} {1} {2!r} returned a false value'.format(a, symbol, b)
+
+class AssertRewriter(ast.NodeTransformer):
+    """Rewrite each assert that compares two values, as shown above."""
+
+    def visit_Assert(self, node):
+        test = node.test
+        if (node.msg is not None or not isinstance(test, ast.Compare)
+            or len(test.ops) != 1 or type(test.ops[0]) not in _symbols):
+            return node
+        symbol = _symbols[type(test.ops[0])]
+        if _python_version >= (3,8):
+            symbol = ast.Constant(symbol)
+        else:
+            symbol = ast.Str(symbol)
+        def load(name):
+            return ast.Name(name, ast.Load())
+        def store(name, value):
+            return ast.Assign([ast.Name(name, ast.Store())], value)
+        left, right = load('@assay_left'), load('@assay_right')
+        message = ast.Call(load(EXPLAIN), [symbol, left, right], [])
+        new_node = ast.If(load('__debug__'), [
+            store('@assay_left', test.left),
+            store('@assay_right', test.comparators[0]),
+            ast.If(ast.UnaryOp(ast.Not(),
+                               ast.Compare(left, test.ops, [right])), [
+                ast.Raise(ast.Call(load('AssertionError'), [message], []),
+                          None),
+                ], []),
+            ], [])
+        return ast.fix_missing_locations(ast.copy_location(new_node, node))
+
+def rewrite_asserts_on_import(module_name):
+    """Have the module `module_name` rewritten when it is next imported.
+
+    Does nothing before Python 3.4, whose tests instead fall back to
+    re-running a test to examine its failed assert.
+
+    """
+    if _rewriting_finder is None:
+        return
+    _rewriting_finder.names.add(module_name)
+    if _rewriting_finder not in sys.meta_path:
+        sys.meta_path.insert(0, _rewriting_finder)
+
+def rewritten_code_tag():
+    """Return the tag that rewritten bytecode is cached under, if any.
+
+    This is the `optimization` argument to ``cache_from_source()``, and
+    is None where asserts are not rewritten on import.
+
+    """
+    if _rewriting_finder is None:
+        return None
+    return 'assay{0}o{1}'.format(REWRITE_VERSION, sys.flags.optimize)
+
+def cache_rewritten_code(path):
+    """Rewrite the asserts of the source file `path`, caching the result."""
+    RewritingLoader(path, path).get_code(path)
+
+_rewriting_finder = None
+
+if _python_version >= (3,4):
+    from importlib.machinery import PathFinder, SourceFileLoader
+    from importlib.util import MAGIC_NUMBER, cache_from_source
+
+    # Our bytecode header has the same fields as an ordinary one.
+    _header_fields = Struct('<III')
+
+    class RewritingFinder(object):
+        """Find the modules in `names` and give them a RewritingLoader."""
+
+        def __init__(self):
+            self.names = set()
+
+        def find_spec(self, fullname, path=None, target=None):
+            if fullname not in self.names:
+                return None
+            spec = PathFinder.find_spec(fullname, path, target)
+            if spec is None or type(spec.loader) is not SourceFileLoader:
+                return None
+            spec.loader = RewritingLoader(fullname, spec.origin)
+            return spec
+
+    class RewritingLoader(SourceFileLoader):
+        """Load a module from source with its asserts rewritten.
+
+        The rewritten code is cached beside the module's ordinary
+        bytecode, under a name of its own, and is used for as long as
+        the source file's modification time and size are unchanged.
+
+        """
+        def exec_module(self, module):
+            module.__dict__[EXPLAIN] = explain
+            super(RewritingLoader, self).exec_module(module)
+
+        def get_code(self, fullname):
+            path = self.get_filename(fullname)
+            stat = os.stat(path)
+            header = MAGIC_NUMBER + _header_fields.pack(
+                0, int(stat.st_mtime) & 0xFFFFFFFF,
+                stat.st_size & 0xFFFFFFFF)
+            cache_path = cache_from_source(path,
+                                           optimization=rewritten_code_tag())
+            try:
+                with open(cache_path, 'rb') as f:
+                    data = f.read()
+                if data.startswith(header):
+                    return marshal.loads(data[len(header):])
+            except (IOError, OSError, EOFError, ValueError, TypeError):
+                pass
+            tree = compile(self.get_data(path), path, 'exec',
+                           ast.PyCF_ONLY_AST, dont_inherit=True)
+            code = compile(AssertRewriter().visit(tree), path, 'exec',
+                           dont_inherit=True)
+            if not sys.dont_write_bytecode:
+                self.set_data(cache_path, header + marshal.dumps(code))
+            return code
+
+    _rewriting_finder = RewritingFinder()
+
 def search_for_function(code, candidate, frame, name):
     """Find the function whose code object is `code`, else return None."""
     if get_code(candidate) is code:
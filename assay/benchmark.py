@@ -1,34 +1,241 @@
+"""Measure the speed of Assay's moving parts.
+
+Run ``python -m assay.benchmark`` for a human-readable report, or add
+``--json`` to get a machine-readable report that can be saved and then
+compared against the results from other versions of Assay.
+
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
 from time import time
-from assay.worker import Worker
 
 def dot():
     return '.'
 
-def main():
-    worker = Worker()
+def generate_dots(count):
+    for i in range(count):
+        yield '.'
 
-    n = 2000
+heap = []
 
-    t0 = time()
-    for item in range(n):
-        assert worker.call(int) == 0
-    dt = time() - t0
+def add_to_path(directory):
+    sys.path.insert(0, directory)
 
-    print('{0:,.6f} s = {1:,.1f} /s: Using a worker to call a built-in'
-          .format(dt / n, n / dt))
+def grow_heap(count):
+    """Fill the worker with `count` small objects, like a big import would."""
+    heap.extend({'index': i} for i in range(count))
+    return len(heap)
 
-    n = 500
+def sample_assertion():
+    x = 1
+    assert x + 1 == 3
 
+def timed(function, n):
+    """Call `function()` `n` times and return the seconds it took."""
     t0 = time()
     for item in range(n):
+        function()
+    return time() - t0
+
+def bench_call(module, worker):
+    n = 2000
+    def call():
+        assert worker.call(int) == 0
+    return n, timed(call, n)
+
+def bench_push_pop(module, worker):
+    n = 500
+    def push_pop():
         with worker:
             assert worker.call(int) == 0
-    dt = time() - t0
+    return n, timed(push_pop, n)
+
+def bench_push_pop_large_heap(module, worker):
+    n = 200
+    with worker:
+        worker.call(module.grow_heap, 1000000)
+        def push_pop():
+            with worker:
+                assert worker.call(int) == 0
+        return n, timed(push_pop, n)
+
+def bench_streaming(module, worker):
+    n = 200000
+    with worker:
+        t0 = time()
+        worker.start(module.generate_dots, n)
+        count = 0
+        while True:
+            items = worker.next_batch()
+            if items and items[-1] is StopIteration:
+                count += len(items) - 1
+                break
+            count += len(items)
+        dt = time() - t0
+    assert count == n
+    return n, dt
+
+def bench_runner(module, worker):
+    from .cache import Cache
+    from .monitor import runner_coroutine, warm_up
+    from .unix import EPoll
+
+    module_count = 20
+    tests_per_module = 500
+    directory = tempfile.mkdtemp(prefix='assaybench')
+    try:
+        paths = []
+        for i in range(module_count):
+            path = os.path.join(directory, 'bench_{0}.py'.format(i))
+            with open(path, 'w') as f:
+                for j in range(tests_per_module):
+                    f.write('def test_{0}():\n    pass\n'.format(j))
+            paths.append(path)
+
+        worker.push()
+        worker.call(module.add_to_path, directory)
+        workers = [worker]
+        poller = EPoll()
+        poller.register(worker)
+        cache = Cache(os.path.join(directory, '.assay'))
+        events, base_modules = warm_up(workers, [])
+        reporter = NullReporter()
+
+        t0 = time()
+        runner = runner_coroutine(paths, workers, reporter, cache,
+                                  base_modules, {})
+        next(runner)
+        try:
+            for source, flags in poller.events():
+                runner.send(source)
+        except StopIteration:
+            pass
+        dt = time() - t0
+        poller.unregister(worker)
+        worker.pop()
+    finally:
+        shutil.rmtree(directory)
+
+    n = module_count * tests_per_module
+    assert reporter.tests == n, reporter.tests
+    return n, dt
+
+def bench_assertion_rewrite(module, worker):
+    n = 2000
+    if sys.version_info >= (3, 4):
+        # Test modules are rewritten as they are imported.
+        import ast
+        import inspect
+        from .assertion import AssertRewriter
+        source = inspect.getsource(module.sample_assertion)
+        def rewrite():
+            tree = compile(source, 'sample.py', 'exec', ast.PyCF_ONLY_AST,
+                           dont_inherit=True)
+            compile(AssertRewriter().visit(tree), 'sample.py', 'exec',
+                    dont_inherit=True)
+        return n, timed(rewrite, n)
+
+    from .assertion import rewrite_asserts_in
+    from .compatibility import get_code, set_code
+    function = module.sample_assertion
+    original = get_code(function)
+    def rewrite():
+        rewrite_asserts_in(function)
+        set_code(function, original)
+    return n, timed(rewrite, n)
+
+def bench_reporter(module, worker):
+    from .reporting import BatchReporter
+    n = 100000
+    reporter = BatchReporter(lambda string: None)
+    error = ('E', 'AssertionError', '1 != 2',
+             [('test_sample.py', 3, 'test_sample', 'assert 1 == 2')])
+    def report():
+        reporter.report_passes(9)
+        reporter.report_result(error)
+    return n, timed(report, n // 10)
+
+class NullReporter(object):
+    """A reporter that only counts results."""
+
+    def __init__(self):
+        self.tests = 0
+        self.errors = 0
+
+    def report_passes(self, count):
+        self.tests += count
+
+    def report_result(self, result):
+        self.tests += 1
+        self.errors += result != '.'
+
+    def summarize(self):
+        pass
+
+benchmarks = [
+    ('call', 'Using a worker to call a built-in', bench_call),
+    ('push_pop', 'Pushing, calling, popping a new worker', bench_push_pop),
+    ('push_pop_large_heap', 'Pushing and popping a worker with a big heap',
+     bench_push_pop_large_heap),
+    ('streaming', 'Streaming generator items from a worker', bench_streaming),
+    ('runner', 'Running trivial tests end to end', bench_runner),
+    ('assertion_rewrite', 'Rewriting a function with an assert',
+     bench_assertion_rewrite),
+    ('reporter', 'Reporting results in batch mode', bench_reporter),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m assay.benchmark')
+    parser.add_argument('--json', action='store_true',
+        help='print the results as JSON')
+    parser.add_argument('--transport', choices=['pipe', 'ring'],
+        default='pipe', help='how the worker sends results')
+    parser.add_argument('name', nargs='*',
+        help='the benchmarks to run (default: all of them)')
+    args = parser.parse_args()
+
+    # Pickle must find our functions under their real module name.
+    from assay import benchmark as module
+    from assay.worker import Worker
 
-    print('{0:,.6f} s = {1:,.1f} /s: Pushing, calling, popping a new worker'
-          .format(dt / n, n / dt))
+    worker = Worker(args.transport)
+    results = []
+    try:
+        for name, description, function in benchmarks:
+            if args.name and name not in args.name:
+                continue
+            try:
+                n, dt = function(module, worker)
+            except Exception as e:
+                error = '{0}: {1}'.format(type(e).__name__, e)
+                results.append({'name': name, 'error': error})
+                if not args.json:
+                    print('{0}: {1}'.format(description, error))
+                continue
+            results.append({'name': name, 'n': n, 'seconds': dt,
+                            'per_second': n / dt})
+            if not args.json:
+                print('{0:,.6f} s = {1:,.1f} /s: {2}'
+                      .format(dt / n, n / dt, description))
+    finally:
+        worker.close()
 
-    worker.close()
+    if args.json:
+        report = {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': sys.platform,
+            'transport': args.transport,
+            'benchmarks': results,
+            }
+        print(json.dumps(report, indent=2, sort_keys=True))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,123 @@
+"""Remember what Assay has learned, from one run to the next."""
+
+import json
+import os
+import sys
+from glob import glob
+
+CACHE_DIRECTORY = '.assay'
+BYTECODE_DIRECTORY = os.path.join(CACHE_DIRECTORY, 'bytecode')
+OUTPUT_DIRECTORY = os.path.join(CACHE_DIRECTORY, 'output')
+OUTPUT_VARIABLE = 'ASSAY_OUTPUT_DIRECTORY'
+VERSION = 2
+
+def interpreter_tag():
+    """Return a short name for this Python, like ``'cpython-38'``."""
+    implementation = getattr(sys, 'implementation', None)
+    if implementation is not None and implementation.cache_tag:
+        return implementation.cache_tag
+    return 'cpython-{0}{1}'.format(*sys.version_info[:2])
+
+def use_private_bytecode_cache(directory=BYTECODE_DIRECTORY):
+    """Keep compiled bytecode beneath `directory`, not beside the sources.
+
+    Python 3.8 and later can be told to, and the environment carries
+    the setting to each worker; the files are named for the interpreter
+    and checked against their source before use.  Older versions cannot
+    be redirected, so they are instead told to write no bytecode at all,
+    as is every version if the user already asked for none.
+
+    """
+    if hasattr(sys, 'pycache_prefix') and not sys.dont_write_bytecode:
+        directory = os.path.abspath(directory)
+        os.environ['PYTHONPYCACHEPREFIX'] = directory
+        sys.pycache_prefix = directory
+    else:
+        os.environ['PYTHONDONTWRITEBYTECODE'] = 'please'
+        sys.dont_write_bytecode = True
+
+def use_output_directory(directory=OUTPUT_DIRECTORY):
+    """Have long test output saved beneath `directory`, not in /tmp.
+
+    The environment carries the setting to each worker; if the directory
+    cannot be created, output is saved in the temporary directory.
+
+    """
+    directory = os.path.abspath(directory)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    except OSError:
+        return
+    os.environ[OUTPUT_VARIABLE] = directory
+
+def clear_output_directory():
+    """Remove the output that earlier runs saved in the output directory."""
+    directory = os.environ.get(OUTPUT_VARIABLE)
+    if directory is None:
+        return
+    for path in glob(os.path.join(directory, 'assay-*.txt')):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def get_mtime(path):
+    """Return the modification time of `path`, or None if it is missing."""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+class Cache(object):
+    """A file of facts, each remembered until its source files change.
+
+    Each interpreter gets its own cache file, which is discarded in its
+    entirety if it was written by a different version of Assay or by a
+    different Python executable.  Each individual entry is recorded
+    together with the modification times of the paths it was derived
+    from, and becomes invisible as soon as any of them changes.
+
+    """
+    def __init__(self, directory=CACHE_DIRECTORY):
+        self.directory = directory
+        self.path = os.path.join(directory, interpreter_tag() + '.json')
+        self.identity = [VERSION, sys.executable, sys.version]
+        self.entries = {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get('identity') == self.identity:
+            self.entries = data.get('entries', {})
+
+    def get(self, key, default=None):
+        """Return the value stored under `key` if it is still fresh."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        value, mtimes = entry
+        for path, mtime in mtimes.items():
+            if get_mtime(path) != mtime:
+                del self.entries[key]
+                return default
+        return value
+
+    def set(self, key, value, paths=()):
+        """Store `value`, valid until one of the given `paths` changes."""
+        self.entries[key] = [value, dict((path, get_mtime(path))
+                                         for path in paths)]
+
+    def save(self):
+        """Write the cache to disk, replacing the old file atomically."""
+        temporary_path = '{0}.{1}'.format(self.path, os.getpid())
+        data = {'identity': self.identity, 'entries': self.entries}
+        try:
+            if not os.path.isdir(self.directory):
+                os.mkdir(self.directory)
+            with open(temporary_path, 'w') as f:
+                json.dump(data, f)
+            os.rename(temporary_path, self.path)
+        except (IOError, OSError):
+            pass  # a read-only directory should not stop the tests
@@ -6,20 +6,68 @@ import argparse
 import os
 import sys
 from . import monitor, unix
+from .cache import use_output_directory, use_private_bytecode_cache
 
 def main():
-    os.environ['PYTHONDONTWRITEBYTECODE'] = 'please'
-    sys.dont_write_bytecode = True
+    use_private_bytecode_cache()
+    use_output_directory()
     parser = argparse.ArgumentParser(prog='assay')
     parser.description = 'Fast testing framework'
     parser.add_argument('name', nargs='+',
         help='directory, package, or module to test')
     parser.add_argument('--batch', action='store_true',
         help='run tests once, then exit with success or failure')
+    parser.add_argument('--split', action='store_true',
+        help='divide the tests of slow modules among several workers')
+    parser.add_argument('--transport', choices=['pipe', 'ring'],
+        default='pipe',
+        help='how workers send results: through a pipe (the default),'
+        ' or through a ring buffer in shared memory')
+    parser.add_argument('--workers', type=int, metavar='N',
+        help='run exactly N local workers, instead of one for each CPU'
+        ' that the affinity mask and cgroup quota allow, shrinking the'
+        ' pool while the machine is short of CPU or memory')
+    parser.add_argument('--pin', choices=['cpu', 'node'],
+        help='pin each local worker, and the subprocesses it forks, to a'
+        ' CPU of its own or to the CPUs of one NUMA node')
+    parser.add_argument('--gc-threshold', type=int, metavar='N',
+        help='set the garbage collection threshold of the processes that'
+        ' run tests, so they collect less often and copy fewer pages')
+    parser.add_argument('--memory', action='store_true',
+        help='report how much private and shared memory each test'
+        ' process used')
+    parser.add_argument('--timeout', type=float, metavar='SECONDS',
+        help='kill a test that runs longer than this, report it as a'
+        ' failure, and go on with the rest of its module')
+    parser.add_argument('--module-timeout', type=float, metavar='SECONDS',
+        help='kill a test module that runs longer than this, skipping'
+        ' whatever tests it has left')
+    parser.add_argument('--max-diff', type=int, metavar='CHARACTERS',
+        help='show failed comparisons with diffs of up to this length'
+        ' (default 2048); longer values are compared quickly, showing'
+        ' only their first difference')
+    parser.add_argument('--remote', action='append', default=[],
+        metavar='ADDRESS',
+        help='also run tests on the worker agent at HOST:PORT or at a'
+        ' Unix socket path, started with "python -m assay.worker --listen'
+        ' ADDRESS"; can be given more than once.  An agent runs whatever'
+        ' code it is sent, so both ends must share a secret in the'
+        ' ASSAY_SECRET environment variable, without which an agent only'
+        ' listens on a Unix socket or localhost, as with ":PORT"')
     args = parser.parse_args()
+    if args.pin and not hasattr(os, 'sched_setaffinity'):
+        parser.error('--pin needs Python 3.3 or later on Linux')
     try:
         with unix.configure_tty() as isatty:
-            monitor.main_loop(args.name, args.batch or not isatty)
+            monitor.main_loop(args.name, args.batch or not isatty,
+                              split=args.split, transport=args.transport,
+                              remotes=args.remote,
+                              worker_count=args.workers, pin=args.pin,
+                              gc_threshold=args.gc_threshold,
+                              report_memory=args.memory,
+                              timeout=args.timeout,
+                              module_timeout=args.module_timeout,
+                              max_diff=args.max_diff)
     except monitor.Restart:
         print()
         print(' Restart '.center(79, '='))
@@ -4,9 +4,19 @@ import os
 import re
 import sys
 from keyword import iskeyword
-from .importation import get_directory_of, import_modules, list_module_paths
+from .importation import (get_directory_of, import_modules, is_installed,
+                          list_module_paths)
+from .worker import RemoteWorker
 
 matches_dot_py = re.compile(r'[A-Za-z_][A-Za-z_0-9]*\.py$').match
+matches_identifier = re.compile(r'[A-Za-z_][A-Za-z_0-9]*$').match
+
+# Directories where installed packages live, wherever they are.
+_package_homes = ('site-packages', 'dist-packages')
+
+# The parent walks a package tree breadth first until this many packages
+# are waiting to be listed, then divides them among the local workers.
+FAN_OUT_PACKAGES = 64
 
 def interpret_argument(worker, name):
     """
@@ -36,24 +46,193 @@ def interpret_argument(worker, name):
     print('Error - can neither open nor import: {0}'.format(name))
     exit(1)
 
-def search_argument(import_directory, import_name):
-    """Given a tuple returned by `interpret_argument()`, find tests."""
-    if import_directory is not None:
-        sys.path.insert(0, import_directory)
-    package_directory = get_directory_of(import_name)
-    names = [import_name]
-    if package_directory is not None:
-        # TODO: make this recursive; tried to use os.walk(), but it looks
-        # a bit awkward for this - makes us keep re-discovering where we are.
-        # TODO: ignore subdirectories that cannot be package names?
-        # Or that do not look test-like? Hmm. Big decisions there.
-        for filename in os.listdir(package_directory):
+def search_argument(workers, import_directory, import_name):
+    """Given a tuple returned by `interpret_argument()`, find tests.
+
+    Returns the names of the modules found, and the directories whose
+    contents decide the answer: every package directory searched, and
+    every subdirectory that would be searched if it became a package.
+    A package is searched recursively, though only down through
+    subdirectories that are packages too.  No user code is imported by
+    this process; if the package directory can only be learned by
+    importing it, the import happens in a worker.
+
+    """
+    if import_directory is None:
+        with workers[0]:
+            package_directory = workers[0].call(get_directory_of,
+                                                import_name)
+    else:
+        package_directory = os.path.join(import_directory,
+                                         *import_name.split('.'))
+        if not os.path.isdir(package_directory):
+            package_directory = None
+    if package_directory is None:
+        return [import_name], []
+
+    names = [import_name] if import_name else []
+    prefix = import_name + '.' if import_name else ''
+    directories = []
+    packages = [(package_directory, prefix)]
+    while packages and len(packages) < FAN_OUT_PACKAGES:
+        directory, prefix = packages.pop(0)
+        directories.append(directory)
+        more_names, subpackages, others = list_package(directory, prefix)
+        names.extend(more_names)
+        packages.extend(subpackages)
+        directories.extend(others)
+
+    local_workers = [worker for worker in workers
+                     if not isinstance(worker, RemoteWorker)]
+    if len(packages) > 1 and len(local_workers) > 1:
+        shares = [packages[i::len(local_workers)]
+                  for i in range(len(local_workers))]
+        busy = [(worker, share) for worker, share
+                in zip(local_workers, shares) if share]
+        for worker, share in busy:
+            worker.push()
+            worker.start(search_packages, share)
+        results = []
+        for worker, share in busy:
+            results.append(worker.next())
+            worker.pop()
+    else:
+        results = [search_packages(packages)]
+    for more_names, more_directories in results:
+        names.extend(more_names)
+        directories.extend(more_directories)
+    return sorted(names), sorted(directories)
+
+def search_packages(packages):
+    """Search each ``(directory, prefix)`` package, and those beneath it.
+
+    Returns the names of the modules found, and the directories searched
+    together with those that would be searched if they were packages.
+
+    """
+    names = []
+    directories = []
+    packages = list(packages)
+    while packages:
+        directory, prefix = packages.pop()
+        directories.append(directory)
+        more_names, subpackages, others = list_package(directory, prefix)
+        names.extend(more_names)
+        packages.extend(subpackages)
+        directories.extend(others)
+    return names, directories
+
+def list_package(directory, prefix):
+    """List the modules and subpackages in a package directory.
+
+    Returns the module names, each beginning with `prefix`; then a
+    ``(directory, prefix)`` tuple for each subpackage, whose name is
+    also included among the module names; and then the path of each
+    subdirectory that would be a subpackage if it held an
+    ``__init__.py``.  Subdirectories are ignored unless their names are
+    identifiers, and symbolic links to directories are ignored so that
+    a cycle of them cannot trap the search.
+
+    """
+    names = []
+    packages = []
+    others = []
+    try:
+        entries = list_directory(directory)
+    except OSError:
+        return names, packages, others
+    for filename, is_directory in entries:
+        if is_directory:
+            if is_identifier(filename):
+                path = os.path.join(directory, filename)
+                if is_package(path):
+                    names.append(prefix + filename)
+                    packages.append((path, prefix + filename + '.'))
+                else:
+                    others.append(path)
+        else:
             module_name = module_name_of(filename)
-            if not module_name:
-                continue
-            names.append(import_name + '.' + module_name)
+            if module_name and module_name != '__init__':
+                names.append(prefix + module_name)
+    return names, packages, others
+
+if hasattr(os, 'scandir'):
+    def list_directory(directory):
+        """Return the name of each entry and whether it is a directory."""
+        return [(entry.name, entry.is_dir(follow_symlinks=False))
+                for entry in os.scandir(directory)]
+else:
+    def list_directory(directory):
+        """Return the name of each entry and whether it is a directory."""
+        return [(name, not name.endswith('.py')
+                 and is_real_directory(os.path.join(directory, name)))
+                for name in os.listdir(directory)]
+
+    def is_real_directory(path):
+        return os.path.isdir(path) and not os.path.islink(path)
+
+def discover_tests(workers, argument, cache):
+    """Return the names of the test modules specified by `argument`.
+
+    The answer is remembered in `cache` for as long as the directories
+    that decided it remain unchanged, including those skipped because
+    they were not packages, so that a restart of Assay does not need to
+    search or import anything to rediscover the same tests.
+
+    """
+    key = 'discovery ' + argument
+    names = cache.get(key)
+    if names is None:
+        import_directory, import_name = interpret_argument(workers[0],
+                                                           argument)
+        names, directories = search_argument(workers, import_directory,
+                                             import_name)
+        cache.set(key, names, directories)
     return names
 
+def find_project_sources(arguments):
+    """Return the paths of the project's Python source files.
+
+    These are the ``.py`` files in each directory on ``sys.path`` that
+    lies outside of the Python installation and is not some other place
+    where packages get installed, and in the packages beneath it, plus
+    those named by `arguments` that are files or directories.  Like test
+    discovery, this imports nothing.
+
+    """
+    directories = [os.path.abspath(entry) for entry in sys.path]
+    directories = [directory for directory in directories
+                   if os.path.isdir(directory) and not is_installed(directory)
+                   and os.path.basename(directory) not in _package_homes]
+    paths = []
+    for argument in arguments:
+        if os.path.isdir(argument):
+            directories.append(os.path.abspath(argument))
+        elif argument.endswith('.py') and os.path.isfile(argument):
+            paths.append(os.path.abspath(argument))
+    for directory in set(directories):
+        paths.extend(list_sources(directory))
+    return sorted(set(paths))
+
+def list_sources(directory):
+    """Return the ``.py`` files in `directory` and in packages beneath it."""
+    paths = []
+    directories = [directory]
+    while directories:
+        directory = directories.pop()
+        try:
+            entries = list_directory(directory)
+        except OSError:
+            continue
+        for filename, is_directory in entries:
+            path = os.path.join(directory, filename)
+            if not is_directory:
+                if matches_dot_py(filename):
+                    paths.append(path)
+            elif is_identifier(filename) and is_package(path):
+                directories.append(path)
+    return paths
+
 def _discover_enclosing_packages(directory, names):
     """Find the top-level directory surrounding a package or sub-package."""
     was_absolute = directory.startswith(os.sep)
@@ -77,7 +256,7 @@ def is_package(directory):
     return os.path.isfile(os.path.join(directory, '__init__.py'))
 
 def is_identifier(name):
-    return re.match('[A-Za-z_][A-Za-z0-9_]*', name) and not iskeyword(name)
+    return matches_identifier(name) and not iskeyword(name)
 
 def module_name_of(filename):
     if matches_dot_py(filename):
@@ -1,6 +1,14 @@
 """Routines that understand Python importation."""
 
+import os
+import pkgutil
 import sys
+from struct import Struct
+
+try:
+    from importlib.util import find_spec
+except ImportError:
+    find_spec = None
 
 if sys.version_info >= (2, 7):
     from importlib import import_module
@@ -33,19 +41,127 @@ def import_modules(module_names):
     for module_name in module_names:
         try:
             import_module(module_name)
-        except ImportError:
+        except Exception:
             continue
         new = set(name for name, m in sys.modules.items() if m is not None)
         import_events.append((module_name, new - old))
         old = new
     return import_events
 
+_installation_prefixes = tuple(set(
+    os.path.join(getattr(sys, name), '')
+    for name in ('prefix', 'exec_prefix', 'base_prefix', 'real_prefix')
+    if getattr(sys, name, None)))
+
 def list_module_paths():
+    """Return the name and source path of each module that is loaded.
+
+    A module loaded from a ``.pyc`` file is listed under the path of the
+    ``.py`` source next to it, as that is the file a user would edit;
+    unless that source is missing, making the ``.pyc`` an orphan, which
+    is then listed itself so that the caller can complain about it.
+
+    """
     items = list(sys.modules.items())
-    return [(name, module.__file__) for name, module in items
+    return [(name, source_path_of(module.__file__)) for name, module in items
             if module is not None
             and getattr(module, '__file__', None) is not None]
 
+def source_path_of(path):
+    """Return the path of the source file next to a ``.pyc`` or ``.pyo``.
+
+    If the bytecode sits on disk with no such source file beside it,
+    the path is returned unchanged.
+
+    """
+    if path.endswith(('.pyc', '.pyo')):
+        source_path = path[:-1]
+        if (is_installed(path) or os.path.exists(source_path)
+            or not os.path.exists(path)):
+            return source_path
+    return path
+
+def find_source_path(module_name):
+    """Return the source path that `module_name` would be imported from.
+
+    Unlike `list_module_paths()`, this also works for a module whose
+    import failed.  Returns None if no file can be found for it.
+
+    """
+    try:
+        if find_spec is not None:
+            spec = find_spec(module_name)
+            path = spec and spec.has_location and spec.origin
+        else:
+            loader = pkgutil.get_loader(module_name)
+            path = loader and loader.get_filename()
+    except Exception:
+        return None
+    return source_path_of(path) if path else None
+
+def is_orphan(path):
+    """Return whether a path from `list_module_paths()` is orphan bytecode."""
+    return path.endswith(('.pyc', '.pyo'))
+
+def is_installed(path):
+    """Return whether `path` lives inside of the Python installation."""
+    return path.startswith(_installation_prefixes)
+
+# After its magic number, a ``.pyc`` header has a flags word and then,
+# unless flag bit 0 says it is checked by hash, the source's modification
+# time and size.
+_PYC_FIELDS = Struct('<III')
+
+def needs_compiling(path, tag=''):
+    """Return whether the source at `path` lacks up-to-date bytecode.
+
+    Always returns False if Python is not writing bytecode to a private
+    cache, which is only possible from Python 3.8 onward.  A `tag` asks
+    about bytecode cached under that optimization tag instead.
+
+    """
+    if not getattr(sys, 'pycache_prefix', None) or not path.endswith('.py'):
+        return False
+    from importlib.util import MAGIC_NUMBER, cache_from_source
+    try:
+        source = os.stat(path)
+    except OSError:
+        return False
+    try:
+        with open(cache_from_source(path, optimization=tag), 'rb') as f:
+            header = f.read(4 + _PYC_FIELDS.size)
+    except (IOError, OSError):
+        return True
+    if len(header) < 4 + _PYC_FIELDS.size or header[:4] != MAGIC_NUMBER:
+        return True
+    flags, mtime, size = _PYC_FIELDS.unpack(header[4:])
+    if flags & 1:
+        return False  # the import system checks the hash itself
+    return (mtime, size) != (int(source.st_mtime) & 0xFFFFFFFF,
+                             source.st_size & 0xFFFFFFFF)
+
+def compile_sources(paths, rewrite=()):
+    """Compile each source file in `paths`, yielding each path when done.
+
+    Paths that are also in `rewrite` are test modules, whose asserts are
+    rewritten as they are imported, so it is their rewritten code that
+    gets compiled and cached.  A file that fails to compile is skipped,
+    as its import will report the problem in a more useful place.
+
+    """
+    import py_compile
+    from .assertion import cache_rewritten_code
+    for path in paths:
+        try:
+            if path in rewrite:
+                cache_rewritten_code(path)
+            else:
+                py_compile.compile(path, doraise=True)
+        except (py_compile.PyCompileError, SyntaxError, ValueError,
+                IOError, OSError):
+            pass
+        yield path
+
 def improve_order(import_events):
     """Given an `import_events` list, return a new module import order.
 
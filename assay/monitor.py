@@ -2,15 +2,23 @@
 
 from __future__ import print_function
 
+import gc
 import os
+import select
 import sys
+from math import ceil
+from time import time
 from . import unix
-from .discovery import interpret_argument, search_argument
+from .assertion import rewritten_code_tag, set_max_diff
+from .cache import Cache, clear_output_directory
+from .discovery import discover_tests, find_project_sources
 from .filesystem import Filesystem
-from .importation import list_module_paths
-from .reporting import BatchReporter, InteractiveReporter
+from .importation import (compile_sources, find_source_path, import_modules,
+                          improve_order, is_installed, is_orphan,
+                          list_module_paths, needs_compiling)
+from .reporting import BatchReporter, CompilationReporter, InteractiveReporter
 from .runner import capture_stdout_stderr, run_tests_of
-from .worker import Worker
+from .worker import Crashed, ExitPipe, RemoteWorker, Worker
 
 class Restart(BaseException):
     """Tell ``main()`` that we need to restart."""
@@ -20,6 +28,20 @@ stdin_fd = sys.stdin.fileno()
 stdout_fd = sys.stdout.fileno()
 ctrl_d = b'\x04'
 
+# When no explicit worker count is given, the pool is sized at startup,
+# and then between the runs of watch mode, according to the kernel's
+# pressure stall percentages: shrunk if tasks are already waiting for a
+# CPU or for memory, and grown back one worker at a time once things are
+# quiet again.  Between runs, the pressure is measured over the time that
+# Assay sat idle, so that its own workers do not count against it.
+CPU_PRESSURE_HIGH = 40.0
+CPU_PRESSURE_LOW = 10.0
+MEMORY_PRESSURE_HIGH = 10.0
+MEMORY_PRESSURE_LOW = 1.0
+
+# Watch mode needs to have been idle this long to measure the pressure.
+IDLE_SECONDS = 1.0
+
 def read_keystrokes():
     """Read user keystrokes from standard input."""
     keystrokes = os.read(stdin_fd, 1024)
@@ -31,7 +53,10 @@ def write(string):
     """Send `string` immediately to standard output, without buffering."""
     os.write(stdout_fd, string.encode('ascii'))
 
-def main_loop(arguments, batch_mode):
+def main_loop(arguments, batch_mode, split=False, transport='pipe',
+              remotes=(), worker_count=None, pin=None, gc_threshold=None,
+              report_memory=False, timeout=None, module_timeout=None,
+              max_diff=None):
     """Run and report on tests while also letting the user type commands."""
 
     main_process_paths = set(path for name, path in list_module_paths())
@@ -49,27 +74,142 @@ def main_loop(arguments, batch_mode):
 
     runner = None  # so our 'finally' clause does not explode
     workers = []
-    try:
-        for i in range(unix.cpu_count()):
-            worker = Worker()
+    cache = Cache()
+    import_events = cache.get('import-events', [])
+
+    if file_watcher is not None:
+        file_watcher.add_paths(cache.get('module-paths', []))
+
+    timeouts = (timeout, module_timeout) if timeout or module_timeout else None
+    alarms = []
+
+    def set_alarm(deadline):
+        """Wake the runner with None at the `deadline` it asked for."""
+        while alarms:
+            alarms.pop().cancel()
+        if deadline is not None:
+            alarms.append(poller.call_at(deadline))
+
+    if worker_count is None:
+        maximum_workers = unix.cpu_count()
+        local_count = target_pool_size(maximum_workers, maximum_workers)
+    else:
+        maximum_workers = local_count = worker_count
+
+    placements = unix.cpu_placements(pin) if pin else None
+
+    def new_worker(index):
+        """Create the local worker that is number `index` in the pool."""
+        cpus = placements[index % len(placements)] if placements else None
+        worker = Worker(transport, cpus)
+        poller.register(worker)
+        poller.register(worker.exit_pipe)
+        return worker
+
+    def close_worker(worker):
+        poller.unregister(worker)
+        if worker.exit_pipe is not None:
+            poller.unregister(worker.exit_pipe)
+        worker.close()
+
+    def start_workers(stale_paths=(), stale_tests=()):
+        for i in range(local_count):
+            workers.insert(0, new_worker(i))
+        if stale_paths or stale_tests:
+            # Before the warm-up, which would compile them one by one.
+            paths = sorted(stale_paths) + sorted(stale_tests)
+            reporter = CompilationReporter(write, len(paths), batch_mode)
+            precompile(workers[:local_count], paths, set(stale_tests),
+                       reporter)
+        for address in remotes:
+            worker = RemoteWorker(address)
             workers.append(worker)
             poller.register(worker)
+        result = warm_up(workers, import_order)
+        configure(workers)
+        return result
+
+    def configure(workers):
+        """Set up the warm images for the children they will fork."""
+        for worker in workers:
+            if gc_threshold is not None:
+                worker.call(gc.set_threshold, gc_threshold)
+            if max_diff is not None:
+                worker.call(set_max_diff, max_diff)
+
+    def resize_pool(size):
+        """Grow or shrink the local workers, which come first in the list.
+
+        This only happens between the runs of watch mode, never during
+        a run, and so never in batch mode, whose single run starts with
+        a pool sized from the pressure before any worker was started.
+
+        """
+        new_workers = []
+        while len(new_workers) + local_count < size:
+            new_workers.insert(0, new_worker(len(new_workers) + local_count))
+        if new_workers:
+            warm_up(new_workers, import_order)
+            configure(new_workers)
+            workers[:0] = new_workers
+        for i in range(local_count - size):
+            close_worker(workers.pop(0))
+        return size
+
+    def stop_workers():
+        while workers:
+            close_worker(workers.pop())
+
+    try:
+        import_order = improve_order(import_events)
+        known_paths = set(cache.get('module-paths', []))
+        for paths in cache.get('dependencies', {}).values():
+            known_paths.update(paths)
+        known_paths.update(find_project_sources(arguments))
+        # Test modules are imported with their asserts rewritten, and so
+        # need the rewritten code compiled, not their ordinary bytecode.
+        tag = rewritten_code_tag()
+        test_paths = set(cache.get('test-paths', [])) if tag else set()
+        stale_paths = [path for path in known_paths - test_paths
+                       if needs_compiling(path)]
+        stale_tests = [path for path in test_paths
+                       if needs_compiling(path, tag)]
+        import_events, base_modules = start_workers(stale_paths, stale_tests)
+        base_paths = set(base_modules.values())
+        idle_since = None
 
-        paths_under_test = set()
+        imports = {}
+        memory = {} if report_memory else None
         reporter = reporter_class(write)
-        runner = runner_coroutine(arguments, workers, reporter,
-                                  paths_under_test)
-        next(runner)
+        clear_output_directory()
+        runner = runner_coroutine(arguments, workers, reporter, cache,
+                                  base_modules, imports, split=split,
+                                  memory=memory, timeouts=timeouts)
+        set_alarm(next(runner))
 
         for source, flags in poller.events():
 
-            if isinstance(source, Worker):
+            if source is None or isinstance(source, (Worker, ExitPipe)):
                 try:
-                    runner.send(source)
+                    set_alarm(runner.send(source))
                 except StopIteration:
+                    set_alarm(None)
+                    test_names = cache.get('dependencies', {})
+                    paths_under_test = set(imports.values())
+                    import_events = learn_imports(import_events, base_modules,
+                                                  imports, test_names)
+                    cache.set('import-events', import_events)
+                    cache.set('module-paths', sorted(paths_under_test))
+                    cache.set('test-paths', sorted(
+                        imports[name] for name in test_names
+                        if name in imports))
+                    cache.save()
+                    if memory:
+                        write(describe_memory(memory))
                     if batch_mode:
                         exit(1 if reporter.errors else 0)
                     file_watcher.add_paths(paths_under_test)
+                    idle_since = idle_reading()
                     #write('Watching {0} paths...'.format(len(paths_under_test)))
 
             elif source is sys.stdin:
@@ -96,41 +236,387 @@ def main_loop(arguments, batch_mode):
                 if paths:
                     write('\n\nFile modified: {0}\n\n'.format(paths[0]))
 
-                paths_under_test = set()
-                reporter = reporter_class(write)
-                runner = runner_coroutine(arguments, workers, reporter,
-                                          paths_under_test)
-                next(runner)
+                if base_paths.intersection(paths):
+                    # The warm image in each worker is now out of date.
+                    stop_workers()
+                    import_order = improve_order(import_events)
+                    import_events, base_modules = start_workers()
+                    base_paths = set(base_modules.values())
+                elif worker_count is None and idle_since is not None:
+                    pressures = idle_pressures(idle_since, idle_reading())
+                    if pressures is not None:
+                        local_count = resize_pool(target_pool_size(
+                            local_count, maximum_workers, *pressures))
+                idle_since = None
+
+                # Only the tests that imported a modified file need to be
+                # re-run, unless the change was to an installed module,
+                # whose dependents we do not keep track of.
+                if any(is_installed(path) for path in paths):
+                    changed_paths = None
+                else:
+                    changed_paths = set(paths)
 
-            # import_order = improve_order(import_order, dangers)
-            # module_paths, events = worker(import_modules, import_order)
+                imports = {}
+                memory = {} if report_memory else None
+                reporter = reporter_class(write)
+                clear_output_directory()
+                runner = runner_coroutine(arguments, workers, reporter, cache,
+                                          base_modules, imports, changed_paths,
+                                          split, memory, timeouts)
+                set_alarm(next(runner))
     finally:
         if runner is not None:
             runner.close()
         for worker in workers:
             worker.close()
+        cache.save()
+
+def idle_reading():
+    """Return the time, and the CPU and memory stall totals, right now."""
+    return time(), unix.stall_seconds('cpu'), unix.stall_seconds('memory')
+
+def idle_pressures(start, end):
+    """Return the CPU and memory pressure between two idle readings.
+
+    Measured from the end of one run to the start of the next, the
+    pressure leaves out the stalls that our own workers caused, which
+    dominate the kernel's ten-second average right after a run.  Returns
+    None if the interval was too short to say anything, and pressures of
+    None if the kernel offers no readings.
+
+    """
+    seconds = end[0] - start[0]
+    if seconds < IDLE_SECONDS:
+        return None
+    return tuple(None if a is None or b is None else 100.0 * (b - a) / seconds
+                 for a, b in zip(start[1:], end[1:]))
+
+def target_pool_size(size, maximum, cpu_pressure=None, memory_pressure=None):
+    """Return how many local workers to run next, given the current `size`.
+
+    The pressures default to the kernel's current readings, and when the
+    kernel offers none the pool simply stays at its `maximum`.
+
+    """
+    if cpu_pressure is None:
+        cpu_pressure = unix.pressure('cpu')
+    if memory_pressure is None:
+        memory_pressure = unix.pressure('memory')
+    if cpu_pressure is None and memory_pressure is None:
+        return maximum
+    cpu_pressure = cpu_pressure or 0.0
+    memory_pressure = memory_pressure or 0.0
+    if (cpu_pressure > CPU_PRESSURE_HIGH
+        or memory_pressure > MEMORY_PRESSURE_HIGH):
+        return max(1, size - max(1, size // 4))
+    if (cpu_pressure < CPU_PRESSURE_LOW
+        and memory_pressure < MEMORY_PRESSURE_LOW):
+        return min(maximum, size + 1)
+    return min(maximum, size)
+
+def precompile(workers, paths, rewrite, reporter):
+    """Compile `paths` to bytecode, dividing them among local `workers`.
+
+    Those also in `rewrite` have their asserts rewritten as they compile.
+
+    """
+    busy = {}
+    for i, worker in enumerate(workers):
+        share = paths[i::len(workers)]
+        if share:
+            worker.push()
+            worker.start(compile_sources, share, rewrite.intersection(share))
+            busy[worker] = busy[worker.exit_pipe] = worker
+    while busy:
+        for source in select.select(list(busy), [], [])[0]:
+            worker = busy.get(source)
+            if worker is None:
+                continue  # it finished earlier in this same batch
+            if source is worker.exit_pipe:
+                items = worker.reap()
+            else:
+                items = worker.next_batch()
+            reporter.report_progress(sum(1 for item in items
+                                         if isinstance(item, str)))
+            if items and items[-1] is StopIteration:
+                worker.pop()
+            elif not (items and isinstance(items[-1], Crashed)):
+                continue
+            del busy[worker], busy[worker.exit_pipe]
+    reporter.summarize()
+
+def warm_up(workers, import_order):
+    """Have every worker import the modules in `import_order`.
+
+    The workers all import in parallel.  The return value is a tuple
+    giving the import events, from which ``improve_order()`` can learn
+    a better order next time, and a dictionary of the modules that are
+    now loaded in each worker's image mapped to their paths.
+
+    """
+    for worker in workers:
+        worker.start(import_modules, import_order)
+    events = [worker.next() for worker in workers][0]
+    events = [(name, sorted(names)) for name, names in events]
+    base_modules = dict(workers[0].call(list_module_paths))
+    return events, base_modules
 
-def runner_coroutine(arguments, workers, reporter, paths_under_test):
-    worker = workers[0]
+def describe_memory(memory):
+    """Summarize the ``(private, shared)`` bytes used by each test module."""
+    name, (private, shared) = max(memory.items(), key=lambda item: item[1])
+    total = sum(private for private, shared in memory.values())
+    return ('\nMemory: {0:.1f} MB private in all test processes; the most'
+            ' was {1:.1f} MB\nprivate and {2:.1f} MB shared, by {3}\n'
+            .format(total / 1e6, private / 1e6, shared / 1e6, name))
+
+def learn_imports(import_events, base_modules, imports, test_names):
+    """Extend `import_events` with installed modules the tests imported.
+
+    Each new module is appended as an event of its own so that the next
+    set of workers can import it once, before forking, instead of every
+    test module having to import it all over again.  Only the modules
+    in `imports` that live in the Python installation qualify: neither
+    the test modules in `test_names` nor the rest of the project's own
+    modules join the warm image, so that editing them never means
+    rebuilding it, and tests record them as dependencies instead.
+
+    """
+    known = set(name for name, names in import_events)
+    known.update(base_modules)
+    known.update(test_names)
+    return import_events + [(name, [name]) for name, path
+                            in sorted(imports.items())
+                            if is_installed(path) and name not in known]
+
+def affected_by(changed_paths, dependencies, unfinished):
+    """Return a test for whether a module must re-run after a change.
+
+    A module needs to re-run if it imported one of the `changed_paths`,
+    if it is not listed in `dependencies` because it has never run, or
+    if it is among the `unfinished` modules of an interrupted run.
+
+    """
+    def is_affected(name):
+        paths = dependencies.get(name)
+        return (paths is None or name in unfinished
+                or not changed_paths.isdisjoint(paths))
+    return is_affected
+
+def schedule(names, durations):
+    """Order `names` so that popping from the end yields the longest first.
+
+    Each module is expected to take as long as it did last time, while
+    modules that have never been timed are guessed to take an average
+    amount of time.  Without any timings, the order is left alone.
+
+    """
+    known = [durations[name] for name in names if name in durations]
+    if not known:
+        return names
+    guess = sum(known) / len(known)
+    return sorted(names, key=lambda name: durations.get(name, guess))
+
+def split_modules(names, durations, worker_count):
+    """Break the slowest modules into parts that several workers can share.
+
+    A module expected to take longer than its fair share of the run,
+    which is the total expected time divided among the workers, is cut
+    into enough parts that each part fits inside that share.  Returns
+    a list of ``(name, part, parts)`` tuples, ordered longest-last.
+
+    """
+    known = [durations[name] for name in names if name in durations]
+    if not known:
+        return [(name, 0, 1) for name in names]
+    guess = sum(known) / len(known)
+    share = sum(durations.get(name, guess) for name in names) / worker_count
+    units = []
+    for name in names:
+        expected = durations.get(name, guess)
+        parts = int(ceil(expected / share)) if share else 1
+        parts = max(1, min(worker_count, parts))
+        units.extend((expected / parts, (name, part, parts))
+                     for part in range(parts))
+    units.sort(key=lambda unit: unit[0])
+    return [unit for expected, unit in units]
+
+def timeout_failure(module_name, test_name, seconds):
+    """Return a failure result for a test or module that ran too long."""
+    if test_name is None:
+        what = 'Module {0}'.format(module_name)
+    else:
+        what = 'Test {0}.{1}()'.format(module_name, test_name)
+    message = '{0} was killed after running for {1} seconds'.format(
+        what, seconds)
+    return 'E', 'Timeout', message, [], '', ''
+
+def crash_failure(module_name, test_name, crash, resumed=False):
+    """Return a failure result for a test or module that crashed."""
+    if test_name is None:
+        what = 'Module {0}'.format(module_name)
+    else:
+        what = 'Test {0}.{1}()'.format(module_name, test_name)
+    message = '{0} crashed its worker, which was {1}'.format(
+        what, crash.describe())
+    if resumed:
+        message += ', but its remaining tests ran when resumed'
+    return 'E', 'Crash', message, [], '', ''
+
+def orphan_failure(module_name, path):
+    """Return a failure result for a module loaded from orphan bytecode."""
+    message = ('Module {0} was imported from {1}, whose source file is'
+               ' missing; delete it if the module is gone'
+               .format(module_name, path))
+    return 'E', 'OrphanBytecode', message, [], '', ''
+
+def runner_coroutine(arguments, workers, reporter, cache, base_modules,
+                     imports, changed_paths=None, split=False, memory=None,
+                     timeouts=None):
+    """Run tests, learning which files each test module imports.
+
+    The name and path of every module that a test module imports, beyond
+    those already in the warm `base_modules`, is added to the `imports`
+    dictionary.  If `changed_paths` is provided, then only test modules
+    that imported one of those paths are run.  If `split` is true, then
+    slow modules have their tests divided among several workers.  If a
+    `memory` dictionary is provided, it is filled in with the private
+    and shared bytes used by the process that ran each module.
+
+    If `timeouts` is a ``(test_seconds, module_seconds)`` pair, either
+    of which can be None, then a test that runs too long is killed and
+    reported, and the rest of its module resumes in a fresh fork, while
+    a module that runs too long is abandoned.  Each time we yield, we
+    yield the time at which the caller should send us None so that we
+    can check the clock, or None if there is no need.
+
+    A worker whose ``exit_pipe`` is sent instead of the worker itself is
+    checked for a crashed subprocess.  The rest of the crashed module is
+    then resumed in a fresh fork in careful mode, which announces each
+    test, sending the announcement and the results before it at once,
+    so that a second crash can be blamed on a particular test, which is
+    then skipped.  Timeouts use careful mode too, to see each test start.
+
+    """
     running_workers = set()
     names = []
 
     for argument in arguments:
-        import_path, import_name = interpret_argument(worker, argument)
-        more_names = search_argument(import_path, import_name)
-        names.extend(more_names)
+        names.extend(discover_tests(workers, argument, cache))
+
+    dependencies = cache.get('dependencies', {})
+    if changed_paths is not None:
+        unfinished = set(cache.get('unfinished', ()))
+        is_affected = affected_by(changed_paths, dependencies, unfinished)
+        names = list(filter(is_affected, names))
+
+    durations = cache.get('durations', {})
+    names = schedule(names, durations)
+    if split:
+        units = split_modules(names, durations, len(workers))
+    else:
+        units = [(name, 0, 1) for name in names]
+    elapsed = {}
+
+    orphans = set()
+
+    def report_orphans(module_paths):
+        for module_name, path in module_paths:
+            if is_orphan(path) and path not in orphans:
+                orphans.add(path)
+                reporter.report_result(orphan_failure(module_name, path))
+
+    def learn_dependencies(name, module_paths):
+        new_paths = set(dependencies.get(name, ()))
+        for module_name, path in module_paths:
+            if module_name not in base_modules:
+                imports[module_name] = path
+                if not is_installed(path):
+                    new_paths.add(path)
+        dependencies[name] = sorted(new_paths)
+        report_orphans(module_paths)
+
+    current_names = {}
+    start_times = {}
+    turns_taken = {}
+    current_tests = {}
+    careful = {}
+    unreported_crashes = {}
+    test_seconds, module_seconds = timeouts or (None, None)
 
     def give_work_to(worker):
-        if names:
-            name = names.pop()
-            worker.start(capture_stdout_stderr, run_tests_of, name)
+        if units:
+            current_names[worker] = units.pop()
+            start_times[worker] = time()
+            turns_taken[worker] = 0
+            careful[worker] = timeouts is not None
+            unreported_crashes.pop(worker, None)
+            start_unit(worker)
         else:
             running_workers.remove(worker)
-            paths = [path for name, path in worker.call(list_module_paths)]
-            paths_under_test.update(paths)
 
-    for worker in workers:
+    def start_unit(worker):
+        name, part, parts = current_names[worker]
+        current_tests[worker] = None, time()
         worker.push()
+        worker.start(capture_stdout_stderr, run_tests_of, name, part,
+                     parts, turns_taken[worker], careful[worker])
+
+    def handle_crash(worker, crash):
+        name = current_names[worker][0]
+        test_name = current_tests[worker][0]
+        if not careful[worker]:
+            # Resume quietly, and learn which test crashes if it recurs.
+            careful[worker] = True
+            unreported_crashes[worker] = crash
+            start_unit(worker)
+            return
+        unreported_crashes.pop(worker, None)
+        reporter.report_result(crash_failure(name, test_name, crash))
+        if test_name is None:
+            finish_unit(worker)
+            give_work_to(worker)
+        else:
+            start_unit(worker)  # skipping the test that crashed
+
+    def finish_unit(worker):
+        name = current_names[worker][0]
+        seconds = time() - start_times[worker]
+        elapsed[name] = elapsed.get(name, 0.0) + seconds
+        durations[name] = elapsed[name]
+        return name
+
+    def next_deadline():
+        if timeouts is None:
+            return None
+        deadlines = []
+        for worker in running_workers:
+            if module_seconds:
+                deadlines.append(start_times[worker] + module_seconds)
+            if test_seconds:
+                deadlines.append(current_tests[worker][1] + test_seconds)
+        return min(deadlines) if deadlines else None
+
+    def check_clock():
+        now = time()
+        for worker in list(running_workers):
+            name = current_names[worker][0]
+            test_name, test_start = current_tests[worker]
+            if module_seconds and now - start_times[worker] >= module_seconds:
+                worker.pop()
+                reporter.report_result(
+                    timeout_failure(name, None, module_seconds))
+            elif test_seconds and now - test_start >= test_seconds:
+                worker.pop()
+                reporter.report_result(
+                    timeout_failure(name, test_name, test_seconds))
+                if test_name is not None:
+                    start_unit(worker)  # skipping the test that hung
+                    continue
+            else:
+                continue
+            finish_unit(worker)
+            give_work_to(worker)
 
     try:
         for worker in workers:
@@ -138,15 +624,60 @@ def runner_coroutine(arguments, workers, reporter, paths_under_test):
             give_work_to(worker)
 
         while running_workers:
-            worker = yield
-            result = worker.next()
-            if result is StopIteration:
-                give_work_to(worker)
+            source = yield next_deadline()
+            if source is None:
+                check_clock()
+                continue
+            if isinstance(source, ExitPipe):
+                worker = source.worker
+                results = worker.reap()
+            elif source in running_workers:
+                worker = source
+                results = worker.next_batch()
             else:
-                reporter.report_result(result)
+                continue  # a stale event from a worker with no work
+            for result in results:
+                if result is StopIteration:
+                    name = finish_unit(worker)
+                    crash = unreported_crashes.pop(worker, None)
+                    if crash is not None:
+                        reporter.report_result(
+                            crash_failure(name, None, crash, resumed=True))
+                    module_paths = worker.call(list_module_paths)
+                    if name not in dict(module_paths):
+                        # Its import failed, but it must re-run once fixed.
+                        path = worker.call(find_source_path, name)
+                        if path is not None:
+                            module_paths.append((name, path))
+                    if memory is not None:
+                        usage = worker.call(unix.memory_usage)
+                        if usage is not None:
+                            memory[name] = max(usage, memory.get(name, usage))
+                    worker.pop()
+                    learn_dependencies(name, module_paths)
+                    give_work_to(worker)
+                elif isinstance(result, Crashed):
+                    handle_crash(worker, result)
+                elif isinstance(result, int):
+                    reporter.report_passes(result)
+                    if not careful[worker]:
+                        turns_taken[worker] += result
+                elif isinstance(result, str) and result != '.':
+                    current_tests[worker] = result, time()
+                    turns_taken[worker] += 1
+                else:
+                    reporter.report_result(result)
+                    if not careful[worker]:
+                        turns_taken[worker] += 1
 
     finally:
-        for worker in workers:
+        for worker in running_workers:
             worker.pop()
+        cache.set('dependencies', dependencies)
+        cache.set('durations', durations)
+        unfinished = units + [current_names[worker]
+                              for worker in running_workers]
+        cache.set('unfinished', sorted(set(name for name, part, parts
+                                           in unfinished)))
 
     reporter.summarize()
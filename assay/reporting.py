@@ -27,13 +27,17 @@ class BatchReporter(object):
         self.tests = 0
         self.t0 = time()
 
+    def report_passes(self, count):
+        self.tests += count
+        self.write_callback('.' * count)
+
     def report_result(self, result):
-        self.tests += 1
         if result == '.':
-            self.write_callback('.')
-        else:
-            self.errors += 1
-            self.write_callback(pretty_format_error(*result))
+            self.report_passes(1)
+            return
+        self.tests += 1
+        self.errors += 1
+        self.write_callback(pretty_format_error(*result))
 
     def summarize(self):
         dt = time() - self.t0
@@ -44,10 +48,32 @@ class BatchReporter(object):
         self.write_callback('\n\n{0} in {1:.2f} seconds\n'.format(tally, dt))
 
 
+class CompilationReporter(object):
+    """Count modules as they are compiled, on a line of their own."""
+
+    def __init__(self, write_callback, total, batch_mode):
+        self.write_callback = write_callback
+        self.total = total
+        self.batch_mode = batch_mode
+        self.done = 0
+        self.t0 = time()
+
+    def report_progress(self, count):
+        self.done += count
+        if not self.batch_mode:
+            self.write_callback('\rCompiling {0} of {1} modules'
+                                .format(self.done, self.total))
+
+    def summarize(self):
+        dt = time() - self.t0
+        self.write_callback('\rCompiled {0} of {1} modules in {2:.2f}'
+                            ' seconds\n'.format(self.done, self.total, dt))
+
+
 class InteractiveReporter(object):
     def __init__(self, write_callback):
         self.write_callback = write_callback
-        self.letters = []
+        self.tests = 0
         self.errors = []
         self.index = 0
         self.column = 0
@@ -63,10 +89,22 @@ class InteractiveReporter(object):
             s = s[i+1:]
         self.column += len(s) - s.count('\033') // 2 * 11
 
+    def report_passes(self, count):
+        self.tests += count
+        if not self.errors:
+            self.write('.' * count)
+            return
+        while count:
+            if self.column >= self.period:
+                self.write_error_count()
+            n = min(count, max(1, self.period - self.column))
+            self.write('.' * n)
+            count -= n
+
     def report_result(self, result):
         is_success = (result == '.')
         letter = '.' if is_success else result[0]
-        self.letters.append(letter)
+        self.tests += 1
         if not self.errors:
             if is_success:
                 self.write('.')
@@ -90,7 +128,7 @@ class InteractiveReporter(object):
     def summarize(self):
         dt = time() - self.t0
         failures = len(self.errors)
-        total = len(self.letters)
+        total = self.tests
         if failures:
             tally = red('\r{0} of {1} tests failed'.format(failures, total))
         else:
@@ -0,0 +1,200 @@
+"""A shared-memory ring buffer for carrying messages out of a worker.
+
+The ring is a file in shared memory that the parent and the worker both
+map.  Its header holds two ever-increasing byte counts: how many bytes
+the worker has written, which only the worker updates, and how many the
+parent has read, which only the parent updates.  The worker copies each
+message into the ring, advances its count, and writes a single byte to
+a wakeup pipe so that the parent's ``epoll()`` notices.  The parent can
+then unpickle a message straight out of the shared pages.
+
+"""
+import errno
+import fcntl
+import mmap
+import os
+import select
+import sys
+import tempfile
+from struct import Struct
+from time import sleep
+
+_python3 = sys.version_info >= (3,)
+
+if _python3:
+    import pickle
+else:
+    import cPickle as pickle
+
+CAPACITY = 1 << 20
+COUNTERS = Struct('@QQ')
+COUNTER = Struct('@Q')
+WRITTEN_OFFSET = 0
+READ_OFFSET = COUNTER.size
+HEADER = Struct('>I')
+WAKE = b'w'
+
+def create_ring_file(capacity=CAPACITY):
+    """Return a descriptor for a new shared-memory file, already unlinked."""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    fd, path = tempfile.mkstemp(prefix='assay-ring-', dir=directory)
+    os.unlink(path)
+    os.ftruncate(fd, COUNTERS.size + capacity)
+    return fd
+
+class Ring(object):
+    """One end of a ring buffer living in the file `fd`."""
+
+    def __init__(self, fd, wake_fd):
+        size = os.fstat(fd).st_size
+        self.map = mmap.mmap(fd, size)
+        self.capacity = size - COUNTERS.size
+        self.wake_fd = wake_fd
+
+    def counters(self):
+        """Return the count of bytes written to and read from the ring."""
+        return COUNTERS.unpack_from(self.map, 0)
+
+    def set_counter(self, offset, count):
+        """Store a count so that the other process never sees it torn.
+
+        Native-size counts are copied whole, where standard sizes are
+        copied byte by byte; and ``pack_into()`` is avoided because it
+        zeroes its target before filling it in.
+
+        """
+        self.map[offset:offset + COUNTER.size] = COUNTER.pack(count)
+
+    def close(self):
+        self.map.close()
+
+class RingWriter(Ring):
+    """The worker's end of the ring."""
+
+    def write(self, data):
+        """Copy `data` into the ring, waiting for room if it is full."""
+        if _python3:
+            data = memoryview(data)
+        base = COUNTERS.size
+        capacity = self.capacity
+        while len(data):
+            written, read = self.counters()
+            room = capacity - (written - read)
+            if not room:
+                self.wait_for_room(written)
+                continue
+            n = min(room, len(data))
+            start = written % capacity
+            first = min(n, capacity - start)
+            self.map[base + start:base + start + first] = data[:first]
+            if n > first:
+                self.map[base:base + n - first] = data[first:n]
+            self.set_counter(WRITTEN_OFFSET, written + n)
+            data = data[n:]
+        os.write(self.wake_fd, WAKE)
+
+    def wait_for_room(self, written):
+        """Wake the parent, then wait until it reads something."""
+        os.write(self.wake_fd, WAKE)
+        while self.counters()[1] + self.capacity == written:
+            sleep(0.0001)
+
+class RingReader(Ring):
+    """The parent's end of the ring."""
+
+    def __init__(self, fd, wake_fd):
+        super(RingReader, self).__init__(fd, wake_fd)
+        self.partial = b''
+        self.closed = False
+        flags = fcntl.fcntl(wake_fd, fcntl.F_GETFL)
+        fcntl.fcntl(wake_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def discard_wakeups(self):
+        """Read and ignore every byte waiting in the wakeup pipe.
+
+        Returns True if the worker has closed its end of the pipe.
+
+        """
+        try:
+            while os.read(self.wake_fd, 4096):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            return False
+        return True
+
+    def read_available(self):
+        """Return every complete message now waiting in the ring.
+
+        This never blocks, and returns an empty list if the worker has
+        not yet finished writing a message.  When no earlier fragment is
+        pending and the new bytes do not wrap around the end of the ring,
+        each message is unpickled directly from shared memory.  Raises
+        EOFError once the worker has closed its wakeup pipe and no
+        messages remain.
+
+        """
+        self.closed = self.discard_wakeups()
+        written, read = self.counters()
+        if written == read:
+            if self.closed:
+                raise EOFError('worker closed its wakeup pipe')
+            return []
+        base = COUNTERS.size
+        start = read % self.capacity
+        end = start + written - read
+        if end > self.capacity:
+            data = self.partial + self.map[base + start:base + self.capacity]
+            data += self.map[base:base + end - self.capacity]
+        elif self.partial:
+            data = self.partial + self.map[base + start:base + end]
+        elif _python3:
+            data = memoryview(self.map)[base + start:base + end]
+        else:
+            data = self.map[base + start:base + end]
+        messages, offset = decode_messages(data)
+        self.partial = bytes(data[offset:])
+        if _python3 and isinstance(data, memoryview):
+            data.release()
+        self.set_counter(READ_OFFSET, written)
+        return messages
+
+    def read(self):
+        """Return a list of one or more messages, waiting if necessary."""
+        while True:
+            messages = self.read_available()
+            if messages:
+                return messages
+            select.select([self.wake_fd], [], [])
+
+    def discard(self):
+        """Discard everything in the ring, including any torn message."""
+        self.discard_wakeups()
+        self.partial = b''
+        written, read = self.counters()
+        self.set_counter(READ_OFFSET, written)
+
+    def salvage(self):
+        """Return the complete messages in the ring, discarding the rest."""
+        messages = self.read_available()
+        self.discard()
+        return messages
+
+def decode_messages(data):
+    """Unpickle the complete length-prefixed messages at the start of `data`.
+
+    Returns a list of messages and the offset where decoding stopped.
+
+    """
+    messages = []
+    offset = 0
+    size = HEADER.size
+    while len(data) - offset >= size:
+        length, = HEADER.unpack(bytes(data[offset:offset + size]))
+        end = offset + size + length
+        if end > len(data):
+            break
+        messages.append(pickle.loads(data[offset + size:end]))
+        offset = end
+    return messages, offset
@@ -7,47 +7,158 @@ import inspect
 import linecache
 import os
 import sys
+import tempfile
+from itertools import count
 from types import FunctionType
-from .assertion import get_code, search_for_function, rewrite_asserts_in
+from . import assertion
+from .assertion import (EXPLAIN, bytecode_tables, get_code,
+                        rewrite_asserts_in, rewrite_asserts_on_import,
+                        search_for_function)
+from .cache import OUTPUT_VARIABLE
 from .importation import import_module
+from .worker import Announcement, Tally
 
 class Failure(Exception):
     """Test failure encountered during importation or setup."""
 
+# A result carries at most this many bytes of each kind of output; the
+# rest is left in a file that the result names.
+OUTPUT_LIMIT = 16384
+
 _python3 = sys.version_info >= (3,)
 _no_such_fixture = object()
-_is_noisy_filename = (__file__, assay.__file__).__contains__
+_is_noisy_filename = (__file__, assay.__file__,
+                      assertion.__file__).__contains__
+_assert_raises_exit_code = get_code(assay.assert_raises.__exit__)
+
+try:
+    from ctypes import CDLL
+    _c_fflush = CDLL(None).fflush
+except Exception:
+    _c_fflush = None
+
+class Spool(object):
+    """A temporary file that captures a file descriptor, like stdout's.
+
+    The file is put in place of `target_fd` with ``dup2()``, so it also
+    receives the output of C libraries and of subprocesses, and is read
+    back result by result; close() restores the original descriptor.
+    The file is unlinked at once, so a worker killed in mid-test leaves
+    nothing behind.  Output of up to OUTPUT_LIMIT bytes is simply read
+    back and erased.  Longer output is copied to a named "spill" file,
+    created the first time it is needed in the directory named by the
+    environment, see ``use_output_directory()``, and only its beginning
+    is returned, together with a note saying where the rest can be found.
+
+    """
+    def __init__(self, name, target_fd):
+        self.name = name
+        self.read_fd, path = tempfile.mkstemp(prefix='assay-')
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+        os.unlink(path)
+        self.spill_fd = None
+        self.target_fd = target_fd
+        self.saved_fd = os.dup(target_fd)
+        os.dup2(self.fd, target_fd)
+
+    def take(self):
+        """Return the output written since the last take() or clear()."""
+        length = os.fstat(self.fd).st_size
+        os.lseek(self.read_fd, 0, os.SEEK_SET)
+        data = os.read(self.read_fd, min(length, OUTPUT_LIMIT))
+        if _python3:
+            data = data.decode('utf-8', 'replace')
+        if length > OUTPUT_LIMIT:
+            offset = self.spill()
+            data += '\n[{0} bytes in all, saved to {1} at offset {2}]\n' \
+                .format(length, self.spill_path, offset)
+        os.ftruncate(self.fd, 0)
+        return data
 
-if _python3:
-    from io import StringIO
-else:
-    from StringIO import StringIO
+    def spill(self):
+        """Append the whole file to the spill file; return where it starts."""
+        if self.spill_fd is None:
+            self.spill_fd, self.spill_path = tempfile.mkstemp(
+                prefix='assay-{0}-'.format(self.name), suffix='.txt',
+                dir=os.environ.get(OUTPUT_VARIABLE))
+        offset = os.lseek(self.spill_fd, 0, os.SEEK_END)
+        os.lseek(self.read_fd, 0, os.SEEK_SET)
+        while True:
+            data = os.read(self.read_fd, 1 << 20)
+            if not data:
+                return offset
+            while data:
+                data = data[os.write(self.spill_fd, data):]
+
+    def clear(self):
+        """Erase the output written since the last take() or clear()."""
+        os.ftruncate(self.fd, 0)
+
+    def close(self):
+        os.dup2(self.saved_fd, self.target_fd)
+        for fd in self.saved_fd, self.fd, self.read_fd, self.spill_fd:
+            if fd is not None:
+                os.close(fd)
+
+def flush_output():
+    """Push output buffered inside this process out to its descriptors."""
+    for stream in sys.stdout, sys.stderr:
+        if stream is not None:
+            stream.flush()
+    if _c_fflush is not None:
+        _c_fflush(None)
 
 def capture_stdout_stderr(generator, *args):
-    """Call a generator, supplementing its tuples with stdout, stderr data."""
-    oldout = sys.stdout
-    olderr = sys.stderr
-    out = StringIO()
-    err = StringIO()
-    sys.stdout = out
-    sys.stderr = err
+    """Call a generator, supplementing its tuples with stdout, stderr data.
+
+    Each passing test, which the generator reports with a ``'.'``, is
+    yielded as a Tally of one, which the worker adds to any other passes
+    in the same batch.  Output is captured at the level
+    of file descriptors 1 and 2, and output longer than OUTPUT_LIMIT is
+    saved to a file instead of being sent in full; see `Spool`.
+
+    """
+    flush_output()
+    out = Spool('stdout', 1)
+    err = Spool('stderr', 2)
     try:
         for item in generator(*args):
-            if isinstance(item, tuple):
-                yield item + (out.getvalue(), err.getvalue())
+            if item == '.':
+                yield Tally(1)
+            elif isinstance(item, tuple):
+                flush_output()
+                yield item + (out.take(), err.take())
+                continue
             else:
                 yield item
-            out.truncate(0)
-            err.truncate(0)
+            flush_output()
+            out.clear()
+            err.clear()
     finally:
-        sys.stdout = oldout
-        sys.stderr = olderr
+        flush_output()
+        out.close()
+        err.close()
+
+def run_tests_of(module_name, part=0, parts=1, skip=0, announce=False):
+    """Run all tests discovered inside of a module.
 
-def run_tests_of(module_name):
-    """Run all tests discovered inside of a module."""
+    A large module can be shared among several workers by giving each a
+    different `part` number, counting up from zero to `parts` minus one.
+    Every test, and every combination of fixture values for each test,
+    is counted off in order and run only by the part whose turn it is.
+    The first `skip` of our turns are passed over, so that a run cut
+    short can resume where it stopped.  If `announce` is true, the name
+    of each test is yielded as an Announcement just before it runs.  Where the
+    Python version allows, the module's asserts are rewritten as it is
+    imported so that they explain their own failures.
+
+    """
     try:
+        rewrite_asserts_on_import(module_name)
         module = import_module(module_name)
     except Exception as e:
+        if part:
+            return
         frames = [frame for frame in traceback_frames()
                   if ('/importlib/' not in frame[0])
                   and (' importlib.' not in frame[0])]
@@ -58,23 +169,64 @@ def run_tests_of(module_name):
                    if k.startswith('test_') and isinstance(v, FunctionType)
                    and getattr(v, '__module__', '') == module_name)
 
+    is_mine = take_turns(part, parts, skip)
     for name, test in tests:
-        for result in run_test(module, test):
+        for result in run_test(module, test, is_mine, announce):
             yield result
 
-def run_test(module, test):
-    """Run a test, detecting whether it needs fixtures and providing them."""
+def take_turns(part, parts, skip=0):
+    """Return a function that answers True once every `parts` calls.
+
+    The first `skip` of the calls that would answer True answer False.
+
+    >>> is_mine = take_turns(1, 3)
+    >>> [is_mine() for i in range(7)]
+    [False, True, False, False, True, False, False]
+    >>> is_mine = take_turns(1, 3, skip=1)
+    >>> [is_mine() for i in range(7)]
+    [False, False, False, False, True, False, False]
+
+    """
+    counter = count(parts - part)
+    first = parts * (skip + 1)
+    def is_mine():
+        n = next(counter)
+        return n % parts == 0 and n >= first
+    return is_mine
+
+def _always():
+    return True
+
+def run_test(module, test, is_mine=_always, announce=False):
+    """Run a test, detecting whether it needs fixtures and providing them.
+
+    Before each run of the test, `is_mine()` is consulted and the test
+    is skipped if it returns false.  A failure to produce fixture values
+    counts as one more turn.  If `announce` is true, the test's name is
+    yielded at the start of each of our turns.
+
+    """
     code = get_code(test)
     if not code.co_argcount:
-        yield run_test_with_arguments(test, ())
+        if is_mine():
+            if announce:
+                yield Announcement(test.__name__)
+            yield run_test_with_arguments(test, ())
         return
 
     try:
         names = inspect.getargs(code).args
         fixtures = [find_fixture(module, name) for name in names]
         for args in generate_arguments_from_fixtures(names, fixtures):
-            yield run_test_with_arguments(test, args)
+            if is_mine():
+                if announce:
+                    yield Announcement(test.__name__)
+                yield run_test_with_arguments(test, args)
     except Exception as e:
+        if not is_mine():
+            return
+        if announce:
+            yield Announcement(test.__name__)
         frames = traceback_frames()
         filename = relativize(code.co_filename)
         firstlineno = code.co_firstlineno
@@ -136,6 +288,10 @@ def run_test_with_arguments(test, args):
         frames, frame = traceback_frames(return_top_frame=True)
         filename, lineno, name, text = frames[-1]
         function = search_for_function(frame.f_code, test, frame, name)
+        if EXPLAIN in frame.f_globals:
+            function = None  # its asserts were rewritten when imported
+        elif bytecode_tables is None:
+            function = None  # its asserts cannot be rewritten at all
         del frame
     except Exception as e:
         frames = traceback_frames()
@@ -174,13 +330,25 @@ def traceback_frames(return_top_frame=False):
 
     """
     etype, e, tb = sys.exc_info()
+    context_tb = None
+    if getattr(e, '__context__', None) is not None:
+        last_tb = tb
+        while last_tb.tb_next is not None:
+            last_tb = last_tb.tb_next
+        if last_tb.tb_frame.f_code is _assert_raises_exit_code:
+            # Instead of the "with" statement, which is where Python 3.11
+            # and later blame an exception from __exit__(), show where
+            # the exception that assert_raises() rejected was raised.
+            context_tb = e.__context__.__traceback__
     tuples = []
     while tb is not None:
+        if context_tb is not None and tb.tb_frame is context_tb.tb_frame:
+            tb, context_tb = context_tb, None
         frame = tb.tb_frame
         code = frame.f_code
         filename = code.co_filename
         if not _is_noisy_filename(filename):
-            lineno = frame.f_lineno
+            lineno = tb.tb_lineno
             line = linecache.getline(filename, lineno, frame.f_globals)
             line = line.strip() if line else None
             tuples.append((relativize(filename), lineno, code.co_name, line))
@@ -1,6 +1,10 @@
 """Sample tests for the Assay test suite to exercise."""
 
+import os
+import signal
+import time
 from assay import assert_raises
+from assay.worker import Announcement, Tally
 
 flags = set()
 
@@ -82,3 +86,30 @@ def test_raises3():
 def test_raises4():
     with assert_raises(ValueError, 'one message'):
         raise ValueError('another message')
+
+def generate_output(count, size):
+    for i in range(count):
+        yield 'x' * size
+
+def generate_slowly(sizes):
+    for size in sizes:
+        yield 'x' * size
+        time.sleep(0.05)
+
+def generate_then_sleep(item, seconds):
+    yield item
+    time.sleep(seconds)
+
+def generate_tallies(count):
+    for i in range(count):
+        yield Tally(1)
+
+def announce_then_crash(name):
+    yield Tally(1)
+    yield Announcement(name)
+    os.kill(os.getpid(), signal.SIGSEGV)
+
+def generate_then_crash(count):
+    for i in range(count):
+        yield i
+    os.kill(os.getpid(), signal.SIGSEGV)
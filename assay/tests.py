@@ -5,20 +5,54 @@ To run these tests, simply invoke::
     $ python -m assay.tests
 
 """
+import gc
 import os
+import py_compile
+import select
 import shutil
+import socket
+import subprocess
 import sys
 import tempfile
+import time
 from contextlib import contextmanager
-from . import samples
+from . import discovery, samples, worker as worker_module
+from .assertion import (assert_equal, assert_in, bytecode_tables,
+                        common_prefix_length, rewrite_asserts_on_import,
+                        rewritten_code_tag)
+from .cache import (OUTPUT_VARIABLE, Cache, clear_output_directory,
+                    use_output_directory)
 from .compatibility import get_code, unittest
-from .discovery import interpret_argument
-from .importation import improve_order, list_module_paths
-from .runner import run_tests_of, run_test
+from .discovery import (discover_tests, find_project_sources,
+                        interpret_argument, search_argument)
+from .importation import (compile_sources, find_source_path, improve_order,
+                          is_installed, is_orphan, list_module_paths,
+                          needs_compiling)
+from .monitor import (affected_by, idle_pressures, learn_imports, schedule,
+                      split_modules, target_pool_size, timeout_failure)
+from .reporting import BatchReporter
+from .runner import (OUTPUT_LIMIT, capture_stdout_stderr, run_tests_of,
+                     run_test)
+from .unix import (EPoll, allowed_cpus, cpu_placements, memory_usage,
+                   parse_cpu_list)
+from .worker import (SECRET_VARIABLE, AuthenticationError, Crashed,
+                     PipeReader, RemoteWorker, Worker, frame, listen,
+                     parse_address, set_batch_size)
 
 _python33 = sys.version_info >= (3, 3)
+_python34 = sys.version_info >= (3, 4)
 _python38 = sys.version_info >= (3, 8)
 
+def import_rewritten(module_name):
+    """Import a fresh copy of a module, with its asserts rewritten."""
+    import importlib
+    rewrite_asserts_on_import(module_name)
+    saved = sys.modules.pop(module_name)
+    try:
+        return importlib.import_module(module_name)
+    finally:
+        sys.modules[module_name] = saved
+
 # Tests.
 
 class DiscoveryTests(unittest.TestCase):
@@ -141,6 +175,67 @@ class DiscoveryTests(unittest.TestCase):
         assert 'p1' not in d
         assert d['p1.p2'] == self.path('p1', 'p2', '__init__.py')
 
+    def test_search_descends_only_into_packages(self):
+        expected_names = ['p1', 'p1.f1', 'p1.m3', 'p1.m4', 'p1.p2',
+                          'p1.p2.m5', 'p1.p2.m6']
+        expected_directories = [self.path('p1'), self.path('p1', 'd1'),
+                                self.path('p1', 'p2')]
+        self.assertEqual(search_argument([], self.base, 'p1'),
+                         (expected_names, expected_directories))
+        workers = [Worker(), Worker()]
+        fan_out = discovery.FAN_OUT_PACKAGES
+        discovery.FAN_OUT_PACKAGES = 1
+        try:
+            self.assertEqual(search_argument(workers, self.base, 'p1'),
+                             (expected_names, expected_directories))
+        finally:
+            discovery.FAN_OUT_PACKAGES = fan_out
+            for worker in workers:
+                worker.close()
+
+    def test_cached_discovery_notices_a_directory_becoming_a_package(self):
+        cache = Cache(os.path.join(self.temporary_directory, '.assay'))
+        argument = self.path('p1')
+        init_path = self.path('p1', 'd1', '__init__.py')
+        workers = [Worker()]
+        try:
+            names = discover_tests(workers, argument, cache)
+            self.assertFalse('p1.d1.m7' in names)
+            with open(init_path, 'w'):
+                pass
+            names = discover_tests(workers, argument, cache)
+            self.assertTrue('p1.d1.m7' in names)
+        finally:
+            workers[0].close()
+            if os.path.exists(init_path):
+                os.unlink(init_path)
+
+    def test_project_sources_are_found_without_leaving_packages(self):
+        paths = find_project_sources([self.path('p1')])
+        self.assertTrue(self.path('p1', 'm3.py') in paths)
+        self.assertTrue(self.path('p1', 'p2', 'm5.py') in paths)
+        self.assertFalse(self.path('p1', 'd1', 'm7.py') in paths)
+
+    def test_orphan_bytecode_is_listed_under_its_own_path(self):
+        directory = tempfile.mkdtemp(prefix='assaytest')
+        name = 'assay_orphan_sample'
+        source = os.path.join(directory, name + '.py')
+        bytecode = source + 'c'
+        with open(source, 'w') as f:
+            f.write('x = 1\n')
+        py_compile.compile(source, bytecode, doraise=True)
+        os.unlink(source)
+        sys.path.insert(0, directory)
+        try:
+            __import__(name)
+            path = dict(list_module_paths())[name]
+            self.assertEqual(path, bytecode)
+            assert is_orphan(path)
+        finally:
+            sys.path.remove(directory)
+            sys.modules.pop(name, None)
+            shutil.rmtree(directory)
+
 
 class RunnerTests(unittest.TestCase):
 
@@ -150,6 +245,81 @@ class RunnerTests(unittest.TestCase):
         value = list(run_tests_of('assay.samples'))
         self.assertEqual(len(value), 24)
 
+    def test_runner_parts_share_the_tests_of_a_module(self):
+        whole = list(run_tests_of('assay.samples'))
+        parts = [list(run_tests_of('assay.samples', part, 3))
+                 for part in range(3)]
+        self.assertEqual(sum(len(results) for results in parts), len(whole))
+        self.assertEqual(parts[1], whole[1::3])
+
+    def test_runner_resumes_after_skipping_turns(self):
+        whole = list(run_tests_of('assay.samples', 1, 3))
+        self.assertEqual(list(run_tests_of('assay.samples', 1, 3, 2)),
+                         whole[2:])
+
+    def test_runner_announces_each_test(self):
+        results = list(run_tests_of('assay.samples', announce=True))
+        names = results[0::2]
+        self.assertEqual(len(names), len(results[1::2]))
+        self.assertTrue(all(name.startswith('test_') for name in names))
+
+    def test_timeout_failure(self):
+        self.assertEqual(timeout_failure('assay.samples', 'test_hang', 2), (
+            'E', 'Timeout', 'Test assay.samples.test_hang() was killed'
+            ' after running for 2 seconds', [], '', ''))
+
+    def test_capture_tallies_passes_between_failures(self):
+        def generator():
+            yield '.'
+            yield '.'
+            print('hello')
+            yield ('E', 'AssertionError', '', [])
+            yield '.'
+        self.assertEqual(list(capture_stdout_stderr(generator)), [
+            1, 1,
+            ('E', 'AssertionError', '', [], 'hello\n', ''),
+            1,
+            ])
+
+    def test_capture_includes_output_of_subprocesses(self):
+        def generator():
+            subprocess.call(['echo', 'spoken'])
+            os.write(2, b'written\n')
+            yield ('E', 'AssertionError', '', [])
+        self.assertEqual(list(capture_stdout_stderr(generator)), [
+            ('E', 'AssertionError', '', [], 'spoken\n', 'written\n'),
+            ])
+
+    def test_capture_saves_long_output_to_a_file(self):
+        text = 'x' * (OUTPUT_LIMIT + 99)
+        def generator():
+            print('ignored')
+            yield '.'
+            sys.stdout.write(text)
+            yield ('E', 'AssertionError', '', [])
+            sys.stderr.write('short')
+            yield ('E', 'AssertionError', '', [])
+        items = list(capture_stdout_stderr(generator))
+        out = items[1][4]
+        path = out.split(' saved to ')[1].split(' at offset ')[0]
+        try:
+            self.assertEqual(out, '{0}\n[{1} bytes in all, saved to {2} at'
+                             ' offset 0]\n'.format(text[:OUTPUT_LIMIT],
+                                                    len(text), path))
+            with open(path) as f:
+                self.assertEqual(f.read(), text)
+            self.assertEqual(items[2][4:], ('', 'short'))
+        finally:
+            os.unlink(path)
+
+    def test_batch_reporter_counts_passes(self):
+        output = []
+        reporter = BatchReporter(output.append)
+        reporter.report_passes(3)
+        reporter.report_result('.')
+        self.assertEqual((reporter.tests, reporter.errors), (4, 0))
+        self.assertEqual(''.join(output), '....')
+
     def test_runner_on_syntax_error(self):
         with tempfile.NamedTemporaryFile(suffix='.py') as f:
             f.write(b'\n\nif while\n')
@@ -171,6 +341,53 @@ class RunnerTests(unittest.TestCase):
              [(f.name, 3, None, 'if while\n' + arrow)]),
             ])
 
+    def test_runner_rewrites_asserts_so_a_test_fails_only_once(self):
+        if not _python34:
+            return
+        with tempfile.NamedTemporaryFile(suffix='.py') as f:
+            f.write(b'calls = []\n'
+                    b'def test_once():\n'
+                    b'    calls.append(1)\n'
+                    b'    assert len(calls) == 2\n')
+            f.flush()
+            module_name = os.path.basename(f.name)[:-3]
+            sys.path.insert(0, os.path.dirname(f.name))
+            import importlib
+            importlib.invalidate_caches()
+            try:
+                value = list(run_tests_of(module_name))
+            finally:
+                del sys.path[0]
+        self.assertEqual(value, [
+            ('E', 'AssertionError', '1 != 2',
+             [(f.name, 4, 'test_once', 'assert len(calls) == 2')]),
+            ])
+        self.assertEqual(sys.modules.pop(module_name).calls, [1])
+
+    def test_rewritten_module_explains_its_failed_asserts(self):
+        if not _python34:
+            return
+        with tempfile.NamedTemporaryFile(suffix='.py') as f:
+            f.write(b'def check(items):\n'
+                    b'    assert 3 in items\n')
+            f.flush()
+            module_name = os.path.basename(f.name)[:-3]
+            rewrite_asserts_on_import(module_name)
+            sys.path.insert(0, os.path.dirname(f.name))
+            import importlib
+            importlib.invalidate_caches()
+            try:
+                module = importlib.import_module(module_name)
+            finally:
+                del sys.path[0]
+                del sys.modules[module_name]
+        module.check([3])
+        try:
+            module.check([1, 2])
+        except AssertionError as e:
+            message = str(e)
+        self.assertEqual(message, '3 not found in [1, 2]')
+
     def test_runner_on_module_that_throws_exception_during_import(self):
         with tempfile.NamedTemporaryFile(suffix='.py') as f1:
           with tempfile.NamedTemporaryFile(suffix='.py') as f2:
@@ -195,10 +412,239 @@ class RunnerTests(unittest.TestCase):
             ])
 
 
+class WorkerTests(unittest.TestCase):
+
+    transport = 'pipe'
+
+    def setUp(self):
+        self.worker = Worker(self.transport)
+
+    def tearDown(self):
+        self.worker.close()
+
+    def test_call(self):
+        self.assertEqual(self.worker.call(int, '42'), 42)
+
+    def test_generator(self):
+        with self.worker:
+            self.worker.start(samples.generate_output, 3, 2)
+            items = [self.worker.next() for i in range(4)]
+        self.assertEqual(items, ['xx', 'xx', 'xx', StopIteration])
+
+    def test_tallies_in_a_batch_are_added_together(self):
+        with self.worker:
+            self.worker.start(samples.generate_tallies, 5)
+            items = [self.worker.next() for i in range(2)]
+        self.assertEqual(items, [5, StopIteration])
+
+    def test_item_is_sent_while_the_generator_is_busy(self):
+        with self.worker:
+            self.worker.start(samples.generate_then_sleep, 'x', 2.0)
+            t0 = time.time()
+            item = self.worker.next()
+            self.assertTrue(time.time() - t0 < 1.0)
+            self.assertEqual(item, 'x')
+            self.assertEqual(self.worker.next(), StopIteration)
+
+    def test_announcement_is_sent_before_a_crash(self):
+        self.worker.push()
+        self.worker.start(samples.announce_then_crash, 'test_crash')
+        items = []
+        while not (items and isinstance(items[-1], Crashed)):
+            exit_pipe = self.worker.exit_pipe
+            sources = [self.worker] + ([exit_pipe] if exit_pipe else [])
+            if exit_pipe in select.select(sources, [], [])[0]:
+                items.extend(self.worker.reap())
+            else:
+                items.extend(self.worker.next_batch())
+        self.assertEqual(items[:2], [1, 'test_crash'])
+
+    def test_runner_is_loaded_before_forking(self):
+        module_paths = self.worker.call(list_module_paths)
+        self.assertIn('assay.runner', dict(module_paths))
+
+    def test_only_children_collect_garbage(self):
+        self.assertFalse(self.worker.call(gc.isenabled))
+        with self.worker:
+            self.assertTrue(self.worker.call(gc.isenabled))
+            private, shared = self.worker.call(memory_usage)
+        self.assertTrue(private > 0)
+
+    def test_crash(self):
+        self.worker.push()
+        self.worker.call(set_batch_size, 1)
+        self.worker.start(samples.generate_then_crash, 3)
+        items = []
+        while not (items and isinstance(items[-1], Crashed)):
+            exit_pipe = self.worker.exit_pipe
+            sources = [self.worker] + ([exit_pipe] if exit_pipe else [])
+            if exit_pipe in select.select(sources, [], [])[0]:
+                items.extend(self.worker.reap())
+            else:
+                items.extend(self.worker.next_batch())
+        self.assertEqual(items[:3], [0, 1, 2])
+        self.assertEqual(items[-1].describe(), 'killed by signal 11')
+        with self.worker:
+            self.assertEqual(self.worker.call(int, '42'), 42)
+
+    def test_pop_in_the_middle_of_a_message(self):
+        self.worker.push()
+        self.worker.start(samples.generate_output, 20, 1000000)
+        self.worker.next()
+        self.worker.pop()
+        self.assertEqual(self.worker.call(int, '42'), 42)
+
+
+class RingWorkerTests(WorkerTests):
+
+    transport = 'ring'
+
+    def test_generator_whose_output_wraps_around_the_ring(self):
+        with self.worker:
+            self.worker.start(samples.generate_output, 5, 300000)
+            items = [self.worker.next() for i in range(6)]
+        self.assertEqual(items, ['x' * 300000] * 5 + [StopIteration])
+
+    def test_messages_following_one_larger_than_the_ring(self):
+        sizes = [1500000, 3, 2, 1]
+        with self.worker:
+            self.worker.call(set_batch_size, 1)
+            self.worker.start(samples.generate_slowly, sizes)
+            items = [self.worker.next() for i in range(5)]
+        self.assertEqual(items, ['x' * size for size in sizes]
+                         + [StopIteration])
+
+
+class PipeReaderTests(unittest.TestCase):
+
+    def test_message_arriving_in_pieces(self):
+        pipe = Pipe()
+        try:
+            reader = PipeReader(pipe.read_fd)
+            data = frame(['x' * 100000]) + frame([1])
+            for piece in data[:2], data[2:50000]:
+                os.write(pipe.write_fd, piece)
+                self.assertEqual(reader.read_available(), [])
+            os.write(pipe.write_fd, data[50000:])
+            self.assertEqual(reader.read(), [['x' * 100000], [1]])
+            os.close(pipe.write_fd)
+            self.assertRaises(EOFError, reader.read_available)
+        finally:
+            os.close(pipe.read_fd)
+
+    def test_each_call_makes_one_bounded_read(self):
+        pipe = Pipe()
+        saved = worker_module.READ_SIZE
+        worker_module.READ_SIZE = len(frame([1]))
+        try:
+            reader = PipeReader(pipe.read_fd)
+            os.write(pipe.write_fd, frame([1]) + frame([2]) + frame([3]))
+            self.assertEqual(reader.read_available(), [[1]])
+            self.assertEqual(reader.read_available(), [[2]])
+            self.assertEqual(reader.salvage(), [[3]])
+            self.assertEqual(reader.read_available(), [])
+        finally:
+            worker_module.READ_SIZE = saved
+            os.close(pipe.read_fd)
+            os.close(pipe.write_fd)
+
+
+class RemoteWorkerTests(WorkerTests):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp(prefix='assaytest')
+        cls.address = os.path.join(cls.directory, 'agent.sock')
+        command = [sys.executable, '-m', 'assay.worker', '--listen',
+                   cls.address]
+        cls.agent = subprocess.Popen(command)
+        while not os.path.exists(cls.address):
+            time.sleep(0.01)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.agent.kill()
+        cls.agent.wait()
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.worker = RemoteWorker(self.address)
+
+    def test_two_connections_get_separate_workers(self):
+        other = RemoteWorker(self.address)
+        try:
+            self.worker.push()
+            other.push()
+            self.assertNotEqual(self.worker.call(os.getpid),
+                                other.call(os.getpid))
+        finally:
+            other.close()
+
+    def test_bare_port_listens_only_on_loopback(self):
+        self.assertEqual(parse_address(':8000'),
+                         (socket.AF_INET, ('127.0.0.1', 8000)))
+        self.assertEqual(parse_address('0.0.0.0:8000'),
+                         (socket.AF_INET, ('0.0.0.0', 8000)))
+
+
+class AgentSecretTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp(prefix='assaytest')
+        cls.address = os.path.join(cls.directory, 'agent.sock')
+        command = [sys.executable, '-m', 'assay.worker', '--listen',
+                   cls.address]
+        env = dict(os.environ)
+        env[SECRET_VARIABLE] = 'sesame'
+        cls.agent = subprocess.Popen(command, env=env)
+        while not os.path.exists(cls.address):
+            time.sleep(0.01)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.agent.kill()
+        cls.agent.wait()
+        shutil.rmtree(cls.directory)
+
+    def test_client_that_knows_the_secret_is_served(self):
+        worker = RemoteWorker(self.address, b'sesame')
+        try:
+            worker.push()
+            self.assertEqual(worker.call(abs, -3), 3)
+        finally:
+            worker.close()
+
+    def test_client_with_the_wrong_secret_is_refused(self):
+        self.assertRaises(AuthenticationError, RemoteWorker, self.address,
+                          b'open sesame')
+        self.assertRaises(AuthenticationError, RemoteWorker, self.address,
+                          b'')
+
+    def test_agent_will_not_listen_on_every_interface_without_one(self):
+        saved = os.environ.pop(SECRET_VARIABLE, None)
+        try:
+            self.assertRaises(ValueError, listen, '0.0.0.0:0')
+        finally:
+            if saved is not None:
+                os.environ[SECRET_VARIABLE] = saved
+
+
 class ErrorMessageTests(unittest.TestCase):
 
     maxDiff = 10000
 
+    # Where asserts cannot be rewritten in place, the samples are instead
+    # imported with their asserts rewritten, just as test modules are.
+    rewritten = bytecode_tables is None
+
+    @classmethod
+    def setUpClass(cls):
+        if cls.rewritten:
+            cls.samples = import_rewritten('assay.samples')
+        else:
+            cls.samples = samples
+
     def execute(self, test):
         """Run the test, making strategic line-number adjustments.
 
@@ -207,9 +653,10 @@ class ErrorMessageTests(unittest.TestCase):
         additional line gets adding a line to the top of ``samples.py``.
 
         """
+        test = getattr(self.samples, test.__name__)
         code = get_code(test)
         base = code.co_firstlineno
-        result = list(run_test(samples, test))
+        result = list(run_test(self.samples, test))
         for item in result:
             if isinstance(item, tuple):
                 frames = item[3]
@@ -260,9 +707,11 @@ class ErrorMessageTests(unittest.TestCase):
 
     def test_assert_that_raises_no_exception_the_second_time(self):
         result = self.execute(samples.test_assert_then_pass)
+        message = ('2 != 3' if self.rewritten else
+                   'Assay re-ran your test to examine its failed assert,'
+                   ' but it passed the second time')
         self.assertEqual(result, [
-            ('E', 'AssertionError', 'Assay re-ran your test to examine its'
-             ' failed assert, but it passed the second time', [
+            ('E', 'AssertionError', message, [
                 ('assay/samples.py', 3, 'test_assert_then_pass',
                  'assert 1+1 == 3')
                 ]),
@@ -270,10 +719,11 @@ class ErrorMessageTests(unittest.TestCase):
 
     def test_assert_that_raises_a_different_exception_the_second_time(self):
         result = self.execute(samples.test_assert_then_die)
+        message = ('2 != 3' if self.rewritten else
+                   'Assay re-ran your test to examine its failed assert,'
+                   ' but the second time it raised ValueError: bad value')
         self.assertEqual(result, [
-            ('E', 'AssertionError', 'Assay re-ran your test to examine its'
-             ' failed assert, but the second time it raised'
-             ' ValueError: bad value', [
+            ('E', 'AssertionError', message, [
                 ('assay/samples.py', 3, 'test_assert_then_die',
                  'assert 1+1 == 3')
                 ]),
@@ -387,6 +837,287 @@ class ErrorMessageTests(unittest.TestCase):
             ])
 
 
+class HugeValueTests(unittest.TestCase):
+
+    def message(self, function, a, b):
+        try:
+            function(a, b)
+        except AssertionError as e:
+            return str(e)
+
+    def test_lists_show_a_window_around_their_first_difference(self):
+        a = list(range(100000))
+        b = a[:50000] + [-1] + a[50001:]
+        self.assertEqual(self.message(assert_equal, a, b),
+                         'list of lengths 100000 and 100000 first differ'
+                         ' at index 50000:\n'
+                         '  left[49997:50004] = [49997, 49998, 49999, 50000,'
+                         ' 50001, 50002, 50003]\n'
+                         ' right[49997:50004] = [49997, 49998, 49999, -1,'
+                         ' 50001, 50002, 50003]')
+
+    def test_strings_are_searched_for_their_first_difference(self):
+        a = 'a' * 9999 + 'b'
+        self.assertEqual(common_prefix_length(a, a[:-1] + 'c', len(a)), 9999)
+        self.assertEqual(common_prefix_length(a, a, len(a)), len(a))
+        self.assertEqual(common_prefix_length(a, 'b', 1), 0)
+
+    def test_dicts_list_examples_of_each_difference(self):
+        a = dict((i, i) for i in range(10000))
+        b = dict((i, i) for i in range(1, 10001))
+        b[5] = -5
+        self.assertEqual(self.message(assert_equal, a, b),
+                         'Dicts of lengths 10000 and 10000 differ\n'
+                         '1 keys only on the left, like 0\n'
+                         '1 keys only on the right, like 10000\n'
+                         '1 keys with different values, including:\n'
+                         '  [5] 5 != -5')
+
+    def test_size_is_judged_at_every_depth(self):
+        a = ['x' * 100000 for i in range(100)]
+        b = list(a)
+        b[50] = 'y'
+        message = self.message(assert_equal, a, b)
+        self.assertTrue(message.startswith(
+            'list of lengths 100 and 100 first differ at index 50:'))
+        self.assertTrue(len(message) < 1000)
+
+    def test_membership_in_a_huge_container_is_described_briefly(self):
+        message = self.message(assert_in, -1, list(range(10000)))
+        self.assertEqual(message, '-1 not found in [0, 1, 2, 3, 4, 5, 6, ...]')
+
+
+class CacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='assaytest')
+        self.source = os.path.join(self.directory, 'source.py')
+        with open(self.source, 'w') as f:
+            f.write('x = 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_value_survives_a_round_trip(self):
+        cache = Cache(self.directory)
+        cache.set('key', ['a', 'b'], [self.source])
+        cache.save()
+        self.assertEqual(Cache(self.directory).get('key'), ['a', 'b'])
+
+    def test_value_expires_when_its_source_changes(self):
+        cache = Cache(self.directory)
+        cache.set('key', ['a', 'b'], [self.source])
+        cache.save()
+        os.utime(self.source, (0, 0))
+        self.assertEqual(Cache(self.directory).get('key', 'gone'), 'gone')
+
+    def test_cache_from_another_version_is_ignored(self):
+        cache = Cache(self.directory)
+        cache.identity = ['some other version']
+        cache.set('key', 'value')
+        cache.save()
+        self.assertEqual(Cache(self.directory).get('key'), None)
+
+    def test_output_directory_is_emptied_of_earlier_output(self):
+        directory = os.path.join(self.directory, 'output')
+        os.mkdir(directory)
+        for filename in 'assay-stdout-old.txt', 'notes.txt':
+            with open(os.path.join(directory, filename), 'w'):
+                pass
+        saved = os.environ.get(OUTPUT_VARIABLE)
+        try:
+            use_output_directory(directory)
+            self.assertEqual(os.environ[OUTPUT_VARIABLE], directory)
+            self.assertEqual(len(os.listdir(directory)), 2)
+            clear_output_directory()
+        finally:
+            if saved is None:
+                del os.environ[OUTPUT_VARIABLE]
+            else:
+                os.environ[OUTPUT_VARIABLE] = saved
+        self.assertEqual(os.listdir(directory), ['notes.txt'])
+
+
+class ChangeImpactTests(unittest.TestCase):
+
+    dependencies = {
+        'tests.test_a': ['/p/tests/test_a.py', '/p/lib.py'],
+        'tests.test_b': ['/p/tests/test_b.py'],
+        }
+
+    def select(self, changed_paths, unfinished=()):
+        is_affected = affected_by(set(changed_paths), self.dependencies,
+                                  set(unfinished))
+        names = ['tests.test_a', 'tests.test_b', 'tests.test_new']
+        return [name for name in names if is_affected(name)]
+
+    def test_change_reruns_only_modules_that_imported_it(self):
+        self.assertEqual(self.select(['/p/lib.py']),
+                         ['tests.test_a', 'tests.test_new'])
+
+    def test_unrelated_change_reruns_only_new_modules(self):
+        self.assertEqual(self.select(['/p/README']), ['tests.test_new'])
+
+    def test_unfinished_modules_are_rerun(self):
+        self.assertEqual(self.select(['/p/README'], ['tests.test_b']),
+                         ['tests.test_b', 'tests.test_new'])
+
+    def test_standard_library_counts_as_installed(self):
+        assert is_installed(os.__file__)
+        assert not is_installed(samples.__file__)
+
+    def test_module_that_fails_to_import_has_a_source_path(self):
+        with tempfile.NamedTemporaryFile(suffix='.py') as f:
+            f.write(b'if while\n')
+            f.flush()
+            module_name = os.path.basename(f.name)[:-3]
+            sys.path.insert(0, os.path.dirname(f.name))
+            try:
+                self.assertEqual(find_source_path(module_name), f.name)
+            finally:
+                del sys.path[0]
+
+    def test_only_installed_modules_join_the_warm_image(self):
+        imports = {'json': os.path.join(os.path.dirname(os.__file__),
+                                        'json', '__init__.py'),
+                   'lib': '/p/lib.py', 'tests.test_a': '/p/tests/test_a.py'}
+        self.assertEqual(learn_imports([], {}, imports, ['tests.test_a']),
+                         [('json', ['json'])])
+
+    @unittest.skipUnless(_python38, 'needs a private bytecode cache')
+    def test_test_modules_are_precompiled_with_asserts_rewritten(self):
+        directory = tempfile.mkdtemp(prefix='assaytest')
+        path = os.path.join(directory, 'test_m.py')
+        with open(path, 'w') as f:
+            f.write('def test_m():\n    assert 1 == 2\n')
+        saved = sys.pycache_prefix, sys.dont_write_bytecode
+        sys.pycache_prefix = os.path.join(directory, 'cache')
+        sys.dont_write_bytecode = False
+        try:
+            tag = rewritten_code_tag()
+            assert needs_compiling(path, tag)
+            self.assertEqual(list(compile_sources([path], {path})), [path])
+            assert not needs_compiling(path, tag)
+            assert needs_compiling(path)
+        finally:
+            sys.pycache_prefix, sys.dont_write_bytecode = saved
+            shutil.rmtree(directory)
+
+
+class EPollTests(unittest.TestCase):
+
+    def test_timers_arrive_in_order_unless_cancelled(self):
+        poller = EPoll()
+        now = time.time()
+        poller.call_at(now + 0.02, 'second')
+        poller.call_at(now + 0.01, 'first')
+        poller.call_at(now, 'cancelled').cancel()
+        events = poller.events()
+        self.assertEqual([next(events) for i in range(2)],
+                         [('first', 0), ('second', 0)])
+
+    def test_unregistered_object_gets_no_stale_event(self):
+        poller = EPoll()
+        pipes = [Pipe(), Pipe()]
+        try:
+            for pipe in pipes:
+                poller.register(pipe)
+                os.write(pipe.write_fd, b'x')
+            poller.call_at(time.time(), 'timer')
+            events = poller.events()
+            source, flags = next(events)
+            other = pipes[1] if source is pipes[0] else pipes[0]
+            poller.unregister(other)
+            self.assertEqual(next(events), ('timer', 0))
+        finally:
+            for pipe in pipes:
+                pipe.close()
+
+
+class Pipe(object):
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+
+    def fileno(self):
+        return self.read_fd
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+class PoolSizeTests(unittest.TestCase):
+
+    def test_parse_cpu_list(self):
+        self.assertEqual(parse_cpu_list('0-3,8,10-11\n'),
+                         set([0, 1, 2, 3, 8, 10, 11]))
+
+    def test_cpu_placements(self):
+        cpus = allowed_cpus()
+        self.assertEqual(cpu_placements('cpu'),
+                         [set([cpu]) for cpu in sorted(cpus)])
+        self.assertEqual(set().union(*cpu_placements('node')), cpus)
+
+    @unittest.skipUnless(hasattr(os, 'sched_getaffinity'), 'needs affinity')
+    def test_pinned_worker_and_its_children(self):
+        cpu = min(allowed_cpus())
+        worker = Worker(cpus=set([cpu]))
+        try:
+            with worker:
+                self.assertEqual(worker.call(os.sched_getaffinity, 0),
+                                 set([cpu]))
+        finally:
+            worker.close()
+
+    def test_pressure_shrinks_the_pool(self):
+        self.assertEqual(target_pool_size(8, 8, 60.0, 0.0), 6)
+        self.assertEqual(target_pool_size(8, 8, 0.0, 20.0), 6)
+        self.assertEqual(target_pool_size(1, 8, 60.0, 20.0), 1)
+
+    def test_quiet_machine_grows_the_pool(self):
+        self.assertEqual(target_pool_size(6, 8, 0.0, 0.0), 7)
+        self.assertEqual(target_pool_size(8, 8, 0.0, 0.0), 8)
+        self.assertEqual(target_pool_size(6, 8, 20.0, 0.0), 6)
+
+    def test_pressure_is_measured_over_the_idle_interval(self):
+        self.assertEqual(idle_pressures((10.0, 5.0, 1.0), (14.0, 6.0, 1.0)),
+                         (25.0, 0.0))
+        self.assertEqual(idle_pressures((10.0, None, None),
+                                        (14.0, None, None)), (None, None))
+        self.assertEqual(idle_pressures((10.0, 5.0, 1.0), (10.5, 6.0, 1.0)),
+                         None)
+
+
+class ScheduleTests(unittest.TestCase):
+
+    def test_longest_module_is_popped_first(self):
+        names = schedule(['a', 'b', 'c'], {'a': 3.0, 'b': 9.0, 'c': 1.0})
+        self.assertEqual(names.pop(), 'b')
+        self.assertEqual(names.pop(), 'a')
+
+    def test_unknown_module_is_guessed_to_be_average(self):
+        names = schedule(['a', 'b', 'new'], {'a': 1.0, 'b': 5.0})
+        self.assertEqual(names, ['a', 'new', 'b'])
+
+    def test_order_is_unchanged_without_history(self):
+        self.assertEqual(schedule(['c', 'a', 'b'], {}), ['c', 'a', 'b'])
+
+
+class SplitModulesTests(unittest.TestCase):
+
+    def test_slow_module_is_split_among_workers(self):
+        durations = {'fast': 1.0, 'slow': 9.0}
+        units = split_modules(['fast', 'slow'], durations, 4)
+        self.assertEqual(units, [
+            ('fast', 0, 1),
+            ('slow', 0, 4), ('slow', 1, 4), ('slow', 2, 4), ('slow', 3, 4),
+            ])
+
+    def test_modules_are_not_split_without_history(self):
+        self.assertEqual(split_modules(['a', 'b'], {}, 4),
+                         [('a', 0, 1), ('b', 0, 1)])
+
+
 class ImproveOrderTests(unittest.TestCase):
 
     # We assume that module B imports A, C imports B, D imports C, et
@@ -2,6 +2,10 @@
 
 import errno
 import fcntl
+import heapq
+import itertools
+import math
+import multiprocessing
 import os
 import select
 import signal
@@ -9,8 +13,10 @@ import sys
 import termios
 import tty
 from contextlib import contextmanager
+from time import time
 
 _everything = 1024 * 1024
+_cgroup_root = '/sys/fs/cgroup'
 
 @contextmanager
 def configure_tty():
@@ -40,41 +46,220 @@ def keep_on_exec(fd):
     fcntl.fcntl(fd, fcntl.F_SETFD, 0)
 
 def cpu_count():
-    """Return the number of CPUs on the system."""
-    if os.path.exists('/proc/cpuinfo'):
-        with open('/proc/cpuinfo') as f:
-            return f.read().count('\nbogomips')
-    return 2
+    """Return how many CPUs this process can actually keep busy.
 
-def discard_input(fileobj, bufsize):
-    """Discard all bytes queued for input on `fileobj`.
+    This is the number of CPUs in our affinity mask, further limited by
+    any cgroup CPU quota, so that a container allowed two CPUs' worth of
+    time on a 64-core host does not start 64 workers.
 
-    Bytes queued in the operating system are disposed of through an
-    ``os.read()``, and bytes in our own buffers by replacing the object.
+    """
+    count = len(allowed_cpus())
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        count = min(count, int(math.ceil(quota)))
+    return max(1, count)
+
+def allowed_cpus():
+    """Return the set of CPU numbers on which this process may run."""
+    if hasattr(os, 'sched_getaffinity'):
+        return os.sched_getaffinity(0)
+    text = _read('/proc/self/status')
+    if text is not None:
+        for line in text.splitlines():
+            if line.startswith('Cpus_allowed_list:'):
+                return parse_cpu_list(line.split(':', 1)[1])
+    return set(range(multiprocessing.cpu_count()))
+
+def cpu_placements(mode):
+    """Return the CPU sets to which successive workers should be pinned.
+
+    With a `mode` of ``'cpu'`` each set holds a single allowed CPU.
+    With ``'node'`` each set holds the allowed CPUs of one NUMA node, so
+    that a worker and the memory it allocates stay on the same socket.
 
     """
-    fd = fileobj.fileno()
-    fcntl.fcntl(fd, fcntl.F_SETFL, os.O_NONBLOCK)
+    allowed = allowed_cpus()
+    if mode == 'cpu':
+        return [set([cpu]) for cpu in sorted(allowed)]
+    nodes = [cpus & allowed for cpus in numa_nodes()]
+    return [cpus for cpus in nodes if cpus] or [set(allowed)]
+
+def numa_nodes():
+    """Return a list giving the set of CPUs of each NUMA node."""
+    directory = '/sys/devices/system/node'
     try:
-        os.read(fd, _everything)
+        names = os.listdir(directory)
     except OSError:
-        pass
-    fcntl.fcntl(fd, fcntl.F_SETFL, 0)
-    return os.fdopen(os.dup(fd), fileobj.mode, bufsize)
+        return []
+    nodes = []
+    for name in sorted(names):
+        if name.startswith('node') and name[4:].isdigit():
+            text = _read(os.path.join(directory, name, 'cpulist'))
+            if text and text.strip():
+                nodes.append((int(name[4:]), parse_cpu_list(text)))
+    return [cpus for number, cpus in sorted(nodes)]
+
+def parse_cpu_list(text):
+    """Parse a kernel CPU list like ``'0-3,8'`` into a set of integers."""
+    cpus = set()
+    for part in text.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+def cgroup_directories():
+    """Return the cgroup v2 and v1 CPU controller directories we live in."""
+    directories = []
+    for line in (_read('/proc/self/cgroup') or '').splitlines():
+        hierarchy, controllers, path = line.split(':', 2)
+        if not controllers:
+            directories.append(_cgroup_root + path)
+        elif 'cpu' in controllers.split(','):
+            directories.append(os.path.join(_cgroup_root, controllers) + path)
+            directories.append(os.path.join(_cgroup_root, 'cpu') + path)
+    directories.append(_cgroup_root)
+    directories.append(os.path.join(_cgroup_root, 'cpu'))
+    return directories
+
+def cgroup_cpu_quota():
+    """Return the CPUs' worth of time our cgroup allows, or None if unlimited.
+
+    Reads ``cpu.max`` under cgroup v2, or ``cpu.cfs_quota_us`` and
+    ``cpu.cfs_period_us`` under cgroup v1.
+
+    """
+    quotas = []
+    for directory in cgroup_directories():
+        text = _read(os.path.join(directory, 'cpu.max'))
+        if text is not None:
+            fields = text.split()
+            if fields[0] != 'max':
+                quotas.append(float(fields[0]) / float(fields[1]))
+            continue
+        quota = _read(os.path.join(directory, 'cpu.cfs_quota_us'))
+        period = _read(os.path.join(directory, 'cpu.cfs_period_us'))
+        if quota is not None and period is not None and int(quota) > 0:
+            quotas.append(float(quota) / float(period))
+    return min(quotas) if quotas else None
+
+def pressure(resource):
+    """Return the share of recent time tasks stalled waiting on `resource`.
+
+    The `resource` is ``'cpu'`` or ``'memory'``, and the result is the
+    ten-second "some" average, as a percentage, from the kernel's
+    pressure stall information.  Returns None if the kernel offers none.
+
+    """
+    value = _stall_field(resource, 'avg10')
+    return None if value is None else float(value)
+
+def stall_seconds(resource):
+    """Return how many seconds tasks have ever stalled on `resource`.
+
+    This is the "some" total from the same pressure stall information,
+    so that two readings can measure the pressure over any interval.
+
+    """
+    value = _stall_field(resource, 'total')
+    return None if value is None else int(value) / 1e6
+
+def _stall_field(resource, name):
+    """Return a field of the "some" line of a pressure file, as text."""
+    paths = [os.path.join(directory, resource + '.pressure')
+             for directory in cgroup_directories()]
+    paths.append(os.path.join('/proc/pressure', resource))
+    for path in paths:
+        text = _read(path)
+        if text is None:
+            continue
+        for line in text.splitlines():
+            fields = line.split()
+            if fields and fields[0] == 'some':
+                for field in fields[1:]:
+                    key, value = field.split('=')
+                    if key == name:
+                        return value
+    return None
+
+def memory_usage(pid='self'):
+    """Return the private and shared bytes of a process's memory.
+
+    Reads the kernel's ``smaps_rollup`` summary, or on kernels older
+    than 4.14 adds up the whole of ``smaps``.  Returns None when neither
+    is available.
+
+    """
+    text = _read('/proc/{0}/smaps_rollup'.format(pid))
+    if text is None:
+        text = _read('/proc/{0}/smaps'.format(pid))
+        if text is None:
+            return None
+    private = shared = 0
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) == 3 and fields[2] == 'kB':
+            if fields[0].startswith('Private_'):
+                private += int(fields[1]) * 1024
+            elif fields[0].startswith('Shared_'):
+                shared += int(fields[1]) * 1024
+    return private, shared
+
+def _read(path):
+    """Return the contents of a small text file, or None if unreadable."""
+    try:
+        with open(path) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+def set_nonblocking(fd):
+    """Make reads and writes on the file descriptor `fd` never block."""
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+def drain(fd):
+    """Read and return all bytes queued for input on the descriptor `fd`."""
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    chunks = []
+    try:
+        while True:
+            chunk = os.read(fd, _everything)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except OSError as e:
+        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+            raise
+    finally:
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags)
+    return b''.join(chunks)
 
 def kill_dash_9(pid):
     """Kill a process with a signal that cannot be caught or ignored."""
     os.kill(pid, signal.SIGKILL)
 
 class EPoll(object):
-    """File descriptor polling object that returns objects, not integers."""
+    """File descriptor polling object that returns objects, not integers.
+
+    It also keeps timers, so that one loop over `events()` can serve as
+    the whole event loop of a process.
+
+    """
 
     def __init__(self):
         self.fdmap = {}
+        self.timers = []
+        self.sequence = itertools.count()
         try:
             self.poller = select.epoll()
+            self.is_epoll = True
         except AttributeError:
             self.poller = select.poll()  # TODO: does this work on OS X?
+            self.is_epoll = False
 
     def register(self, obj, flags=None):
         if flags is None:
@@ -91,12 +276,61 @@ class EPoll(object):
         del self.fdmap[fd]
         self.poller.unregister(fd)
 
+    def call_at(self, when, obj=None):
+        """Have `events()` yield ``(obj, 0)`` once the time `when` arrives.
+
+        Returns a `Timer` whose ``cancel()`` method withdraws the call.
+
+        """
+        timer = Timer(obj)
+        heapq.heappush(self.timers, (when, next(self.sequence), timer))
+        return timer
+
+    def poll(self, timeout=None):
+        """Wait up to `timeout` seconds and return the ready file objects."""
+        if timeout is None:
+            timeout = -1 if self.is_epoll else None
+        elif not self.is_epoll:
+            timeout *= 1000.0
+        try:
+            return self.poller.poll(timeout)
+        except IOError as e:
+            if e.errno != errno.EINTR:
+                raise
+            return []
+
     def events(self):
+        """Yield ``(object, flags)`` pairs as file descriptors are ready.
+
+        Timers set with `call_at()` are yielded as ``(obj, 0)``, but only
+        between the batches of events returned by each poll, so a caller
+        is never handed an event that a timer has already made stale.  An
+        event whose object was unregistered earlier in the same batch is
+        skipped for the same reason.
+
+        """
+        fdmap = self.fdmap
+        timers = self.timers
         while True:
-            try:
-                for fd, flags in self.poller.poll():
-                    yield self.fdmap[fd], flags
-            except IOError as e:
-                if e.errno != errno.EINTR:
-                    raise
+            while timers and timers[0][2].cancelled:
+                heapq.heappop(timers)
+            timeout = max(0.0, timers[0][0] - time()) if timers else None
+            for fd, flags in self.poll(timeout):
+                obj = fdmap.get(fd)
+                if obj is not None:
+                    yield obj, flags
+            now = time()
+            while timers and timers[0][0] <= now:
+                when, sequence, timer = heapq.heappop(timers)
+                if not timer.cancelled:
+                    yield timer.obj, 0
+
+class Timer(object):
+    """A pending call scheduled with `EPoll.call_at()`."""
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.cancelled = False
 
+    def cancel(self):
+        self.cancelled = True
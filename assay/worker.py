@@ -1,8 +1,19 @@
 """A worker process that can respond to commands."""
 
+import errno
+import gc
+import hashlib
+import hmac
 import os
+import select
+import socket
+import struct
 import sys
+import threading
+from collections import deque
+from time import time
 from . import unix
+from .ring import RingReader, RingWriter, create_ring_file, decode_messages
 from types import GeneratorType
 
 _python3 = sys.version_info >= (3,)
@@ -14,16 +25,58 @@ else:
 
 WORKER_TERMINATED = b'!'
 
-# A crucial setting: the buffer size for input from a worker process.
-# If we were to allow buffering of data from the worker, then the buffer
-# might read ahead on the input stream and leave the descriptor looking
-# empty from the point of view of epoll().
-BUFSIZE = 0
+# When a subprocess exits, its parent sends WORKER_TERMINATED and then
+# the exit status from os.waitpid() over the sync pipe.
+EXIT_STATUS = struct.Struct('>I')
+
+# Requests that a remote worker agent handles itself, instead of passing
+# them along to its local worker.
+PUSH = 'push'
+POP = 'pop'
+POPPED = 'popped'
+
+# Before any pickle is exchanged, an agent and its client each prove to
+# the other that they know the shared secret, found in the environment
+# variable SECRET_VARIABLE on both machines, by returning the HMAC of a
+# random challenge.  Without a secret the HMAC key is empty, which only
+# keeps out strangers if they cannot connect at all, so an agent will
+# not listen beyond the loopback interface without one.
+SECRET_VARIABLE = 'ASSAY_SECRET'
+CHALLENGE_SIZE = 32
+WELCOME = b'welcome'
+FAILURE = b'failure'
+
+# Every message in either direction is a pickle preceded by its length,
+# read and written with plain os.read() and os.write() calls.  The parent
+# reads without blocking, keeping any partial message in a buffer of its
+# own until the rest arrives, so one worker sending a huge message never
+# holds up the others.  A message left half-written by a killed worker
+# is discarded by draining the pipe and emptying that buffer.
+HEADER = struct.Struct('>I')
+
+# Items yielded by a generator travel to the parent in batches, each
+# batch a pickled list.  A batch is sent once it grows to BATCH_ITEMS
+# items, or once its oldest item has waited for BATCH_SECONDS, or when
+# the generator is exhausted.  The deadline is kept by a thread, so an
+# item is not held back while the generator is busy producing the next.
+# A Tally yielded right after another one is added to it instead, and
+# an Announcement is sent at once along with the rest of its batch.
+BATCH_ITEMS = 1024
+BATCH_SECONDS = 0.05
+
+# How many bytes the parent asks for at a time.
+READ_SIZE = 1 << 20
 
 class Worker(object):
-    """An object in the main process for communicating with one worker."""
+    """An object in the main process for communicating with one worker.
+
+    Results normally come back through a pipe.  With a `transport` of
+    ``'ring'`` they are instead written into a shared-memory ring buffer
+    and the pipe only carries wakeups.  Given a set of `cpus`, the worker
+    and every subprocess it forks are pinned to those CPUs.
 
-    def __init__(self):
+    """
+    def __init__(self, transport='pipe', cpus=None):
         from_parent, to_worker = os.pipe()
         from_worker, to_parent = os.pipe()
         sync_from_worker, sync_to_parent = os.pipe()
@@ -36,21 +89,38 @@ class Worker(object):
         unix.keep_on_exec(to_parent)
         unix.keep_on_exec(sync_to_parent)
 
+        fds = [from_parent, to_parent, sync_to_parent]
+        if transport == 'ring':
+            ring_fd = create_ring_file()
+            unix.keep_on_exec(ring_fd)
+            fds.append(ring_fd)
+
         worker_pid = os.fork()
         if not worker_pid:
             os.setpgrp()  # prevent worker from receiving Ctrl-C
+            if cpus is not None:
+                os.sched_setaffinity(0, cpus)
             python = sys.executable
-            os.execvp(python, [python, '-m', 'assay.worker', str(from_parent),
-                               str(to_parent), str(sync_to_parent)])
+            os.execvp(python, [python, '-m', 'assay.worker']
+                      + [str(fd) for fd in fds])
 
         os.close(from_parent)
         os.close(to_parent)
         os.close(sync_to_parent)
 
+        if transport == 'ring':
+            self.incoming = RingReader(ring_fd, from_worker)
+            os.close(ring_fd)
+        else:
+            self.incoming = PipeReader(from_worker)
+
         self.pids = [worker_pid]
-        self.to_worker = os.fdopen(to_worker, 'wb')
-        self.from_worker = os.fdopen(from_worker, 'rb', BUFSIZE)
+        self.exit_pipe = ExitPipe(self, sync_from_worker)
+        self.cpus = cpus
+        self.to_worker = to_worker
+        self.from_worker = from_worker
         self.sync_from_worker = sync_from_worker
+        self.items = deque()
 
     def push(self):
         """Have the worker push a new subprocess on top of the stack."""
@@ -60,34 +130,72 @@ class Worker(object):
         """Kill the active worker subprocess and pop it from the stack.
 
         Because we might happen to kill a worker as it is in the middle
-        of writing out a pickle, we listen on the separate "sync" pipe
+        of writing out a message, we listen on the separate "sync" pipe
         for the worker's parent to confirm that the worker has exited.
-        Then we discard any left-over bytes on the data pipe.
+        Nothing else can then be writing to the data pipe, so whatever
+        bytes remain in it are discarded.
 
         """
         unix.kill_dash_9(self.pids.pop())
-        assert os.read(self.sync_from_worker, 1) == WORKER_TERMINATED
-        # Subtle - worker could have died in mid-pickle:
-        self.from_worker = unix.discard_input(self.from_worker, BUFSIZE)
+        read_exit_status(self.sync_from_worker)
+        # Subtle - worker could have died in mid-message:
+        self.incoming.discard()
+        self.items.clear()
+
+    def reap(self):
+        """Pop a subprocess that has exited on its own, like by crashing.
+
+        Returns the items it sent before it died, followed by a `Crashed`
+        item giving its exit status.  If the subprocess is in fact still
+        running, or was already popped, an empty list is returned.
+
+        """
+        if not select.select([self.sync_from_worker], [], [], 0)[0]:
+            return []
+        status = read_exit_status(self.sync_from_worker)
+        self.pids.pop()
+        items = list(self.items)
+        self.items.clear()
+        for batch in self.incoming.salvage():
+            items.extend(batch)
+        items.append(Crashed(status))
+        return items
 
     def call(self, function, *args, **kw):
         """Run a function in the worker process and return its result."""
-        pickle.dump((function, args, kw), self.to_worker)
-        self.to_worker.flush()
-        return pickle.load(self.from_worker)
+        write_message(self.to_worker, (function, args, kw))
+        return self.next()
 
     def start(self, generator, *args, **kw):
         """Start a generator in the worker process."""
-        pickle.dump((generator, args, kw), self.to_worker)
-        self.to_worker.flush()
+        write_message(self.to_worker, (generator, args, kw))
 
     def next(self):
         """Return the next item from the generator given to `start()`."""
-        return pickle.load(self.from_worker)
+        while not self.items:
+            for batch in self.incoming.read():
+                self.items.extend(batch)
+        return self.items.popleft()
+
+    def next_batch(self):
+        """Return a list of the next few items from the generator.
+
+        This returns every item that has already arrived, so that a
+        caller woken by `epoll()` can handle a whole batch of items for
+        a single system call.  The list can be empty if the worker woke
+        us before it finished writing.
+
+        """
+        items = list(self.items)
+        self.items.clear()
+        if not items:
+            for batch in self.incoming.read_available():
+                items.extend(batch)
+        return items
 
     def fileno(self):
         """Return the incoming file descriptor, for `epoll()` objects."""
-        return self.from_worker.fileno()
+        return self.from_worker
 
     def __enter__(self):
         """During a 'with' statement, run commands in a clone of the worker."""
@@ -101,41 +209,493 @@ class Worker(object):
         """Kill the worker and close our file descriptors."""
         while self.pids:
             unix.kill_dash_9(self.pids.pop())
-        self.to_worker.close()
-        self.from_worker.close()
+        os.close(self.to_worker)
+        os.close(self.from_worker)
         os.close(self.sync_from_worker)
 
-def worker_process(from_parent, to_parent, sync_to_parent):
+class RemoteWorker(Worker):
+    """A worker reached through a socket connected to a worker agent.
+
+    The agent, started with ``python -m assay.worker --listen ADDRESS``,
+    runs a local worker on our behalf and relays our commands to it and
+    its results back to us, so the remote worker offers exactly the same
+    interface as a local one.  The `address` is either a ``host:port``
+    pair or the path of a Unix domain socket.  The `secret` defaults to
+    the one in the environment, and must match the agent's.
+
+    """
+    def __init__(self, address, secret=None):
+        family, socket_address = parse_address(address)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.connect(socket_address)
+        if family != socket.AF_UNIX:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        fd = self.socket.fileno()
+        if secret is None:
+            secret = read_secret()
+        try:
+            answer_challenge(fd, secret)
+            deliver_challenge(fd, secret)
+        except (AuthenticationError, EOFError):
+            self.socket.close()
+            raise AuthenticationError('the agent at {0!r} does not share'
+                                      ' our secret'.format(address))
+        self.pids = []
+        self.exit_pipe = None
+        self.to_worker = fd
+        self.from_worker = fd
+        self.incoming = PipeReader(fd)
+        self.items = deque()
+
+    def push(self):
+        """Have the worker push a new subprocess on top of the stack."""
+        write_message(self.to_worker, PUSH)
+        self.pids.append(self.next())
+
+    def pop(self):
+        """Kill the active worker subprocess and pop it from the stack.
+
+        The agent sends only whole messages, so instead of draining a
+        pipe we read and discard messages until the agent confirms that
+        the subprocess is gone.
+
+        """
+        self.pids.pop()
+        self.items.clear()
+        write_message(self.to_worker, POP)
+        while POPPED not in self.incoming.read():
+            pass
+
+    def next_batch(self):
+        """Return the next items, noticing if the agent reaped our child."""
+        items = Worker.next_batch(self)
+        if items and isinstance(items[-1], Crashed):
+            self.pids.pop()
+        return items
+
+    def close(self):
+        """Disconnect, which tells the agent to kill the worker."""
+        self.pids = []
+        self.socket.close()
+
+class AuthenticationError(Exception):
+    """The other end of a connection failed to prove it knows the secret."""
+
+def read_secret():
+    """Return the shared secret from the environment, as bytes."""
+    return os.environ.get(SECRET_VARIABLE, '').encode('utf-8')
+
+def sign(secret, challenge):
+    """Return the HMAC that proves knowledge of `secret`."""
+    return hmac.new(secret, challenge, hashlib.sha256).digest()
+
+def deliver_challenge(fd, secret):
+    """Make the other end of `fd` prove that it knows `secret`."""
+    challenge = os.urandom(CHALLENGE_SIZE)
+    PipeWriter(fd).write(challenge)
+    digest = read_exactly(fd, hashlib.sha256().digest_size)
+    if not hmac.compare_digest(digest, sign(secret, challenge)):
+        PipeWriter(fd).write(FAILURE)
+        raise AuthenticationError('wrong answer to our challenge')
+    PipeWriter(fd).write(WELCOME)
+
+def answer_challenge(fd, secret):
+    """Prove to the other end of `fd` that we know `secret`."""
+    challenge = read_exactly(fd, CHALLENGE_SIZE)
+    PipeWriter(fd).write(sign(secret, challenge))
+    if read_exactly(fd, len(WELCOME)) != WELCOME:
+        raise AuthenticationError('our answer to the challenge was refused')
+
+def is_loopback(host):
+    """Return whether `host` names only this machine."""
+    try:
+        return socket.gethostbyname(host).startswith('127.')
+    except socket.error:
+        return False
+
+class ExitPipe(object):
+    """The sync pipe of a worker, for `epoll()` to watch for crashes."""
+
+    def __init__(self, worker, fd):
+        self.worker = worker
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+class Crashed(object):
+    """The last item from a subprocess that died, with its exit status."""
+
+    def __init__(self, status):
+        self.status = status
+
+    def __repr__(self):
+        return 'Crashed({0})'.format(self.status)
+
+    def describe(self):
+        """Explain the exit status in words."""
+        if os.WIFSIGNALED(self.status):
+            return 'killed by signal {0}'.format(os.WTERMSIG(self.status))
+        return 'exited with status {0}'.format(os.WEXITSTATUS(self.status))
+
+def parse_address(address):
+    """Turn ``'host:port'`` or a Unix socket path into a socket address.
+
+    An empty host means the loopback interface; every interface must be
+    asked for by name, as ``'0.0.0.0:port'``.
+
+    """
+    if '/' in address or ':' not in address:
+        return socket.AF_UNIX, address
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+class PipeReader(object):
+    """Read length-prefixed messages from a pipe, without blocking.
+
+    Bytes are collected as a list of chunks that is only joined once it
+    holds at least `needed` bytes, which is enough for the next message,
+    so a large message arriving in many pieces is copied only once.
+
+    """
+    def __init__(self, fd):
+        self.fd = fd
+        self.chunks = []
+        self.size = 0
+        self.needed = HEADER.size
+        self.closed = False
+        unix.set_nonblocking(fd)
+
+    def read_available(self):
+        """Make a single read, and return the messages now complete.
+
+        The read asks for READ_SIZE bytes, or for as many as the next
+        message still needs if that is more, so that a worker writing
+        without pause cannot keep the caller from its other workers:
+        anything left in the pipe makes `epoll()` report it again.
+        Raises EOFError once the pipe is closed and no messages remain.
+
+        """
+        self.receive(max(READ_SIZE, self.needed - self.size))
+        return self.decode()
+
+    def receive(self, size):
+        """Read up to `size` bytes, returning whether any arrived."""
+        try:
+            chunk = os.read(self.fd, size)
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            return False
+        if not chunk:
+            self.closed = True
+            return False
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        return True
+
+    def decode(self):
+        """Return the complete messages among the bytes received."""
+        if self.size < self.needed:
+            if self.closed:
+                raise EOFError('pipe closed')
+            return []
+        data = b''.join(self.chunks)
+        messages, offset = decode_messages(data)
+        rest = data[offset:]
+        self.chunks = [rest] if rest else []
+        self.size = len(rest)
+        if self.size >= HEADER.size:
+            self.needed = HEADER.size + HEADER.unpack(rest[:HEADER.size])[0]
+        else:
+            self.needed = HEADER.size
+        return messages
+
+    def read(self):
+        """Return a list of one or more messages, waiting if necessary."""
+        while True:
+            messages = self.read_available()
+            if messages:
+                return messages
+            select.select([self.fd], [], [])
+
+    def discard(self):
+        """Discard everything in the pipe, including any torn message."""
+        unix.drain(self.fd)
+        self.chunks = []
+        self.size = 0
+        self.needed = HEADER.size
+
+    def salvage(self):
+        """Return the complete messages in the pipe, discarding the rest."""
+        while self.receive(READ_SIZE):
+            pass
+        messages = self.decode()
+        self.discard()
+        return messages
+
+class PipeWriter(object):
+    """Write bytes to a pipe, waiting for room if it is non-blocking."""
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def write(self, data):
+        while data:
+            try:
+                data = data[os.write(self.fd, data):]
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                select.select([], [self.fd], [])
+
+def read_message(fd):
+    """Read one length-prefixed pickle from the file descriptor `fd`."""
+    length, = HEADER.unpack(read_exactly(fd, HEADER.size))
+    return pickle.loads(read_exactly(fd, length))
+
+def read_exactly(fd, length):
+    """Read exactly `length` bytes from the file descriptor `fd`."""
+    data = os.read(fd, length)
+    while len(data) < length:
+        more = os.read(fd, length - len(data))
+        if not more:
+            raise EOFError('pipe closed in the middle of a message')
+        data += more
+    return data
+
+def read_exit_status(fd):
+    """Read the notice that a subprocess has exited, returning its status."""
+    assert read_exactly(fd, 1) == WORKER_TERMINATED
+    return EXIT_STATUS.unpack(read_exactly(fd, EXIT_STATUS.size))[0]
+
+def frame(obj):
+    """Return `obj` pickled and preceded by its length."""
+    data = pickle.dumps(obj, 2)
+    return HEADER.pack(len(data)) + data
+
+def write_message(fd, obj):
+    """Write `obj` to the file descriptor `fd` as a length-prefixed pickle."""
+    PipeWriter(fd).write(frame(obj))
+
+def worker_process(from_parent, to_parent, sync_to_parent, ring_fd=None):
     """Run functions piped to us from the parent process.
 
     Both `to_parent` and `from_parent` should be integer file
-    descriptors of the pipes connecting us to the parent process.
+    descriptors of the pipes connecting us to the parent process.  If
+    a `ring_fd` is provided, then results are written to that shared
+    memory ring buffer instead, and `to_parent` is only used to wake
+    the parent up.
 
     """
-    to_parent = os.fdopen(to_parent, 'wb')
-    from_parent = os.fdopen(from_parent, 'rb')
+    if ring_fd is None:
+        to_parent = PipeWriter(to_parent)
+    else:
+        to_parent = RingWriter(ring_fd, to_parent)
+        os.close(ring_fd)
+
+    # The objects of a warm image are shared with every child it forks,
+    # until a garbage collection in the child writes to their headers
+    # and so copies the pages beneath them.  So the collector stays off
+    # in the image, which then freezes its objects before each fork so
+    # that children, who turn the collector back on, never examine them.
+    gc.disable()
 
     while True:
-        function, args, kw = pickle.load(from_parent)
+        function, args, kw = read_message(from_parent)
+        if function is os.fork and hasattr(gc, 'freeze'):
+            gc.freeze()
         result = function(*args, **kw)
         if function is os.fork:
             if result:
-                os.waitpid(result, 0)
+                status = os.waitpid(result, 0)[1]
                 # Subtle: worker can die with a command still inbound
-                from_parent = unix.discard_input(from_parent, BUFSIZE)
-                os.write(sync_to_parent, WORKER_TERMINATED)
+                unix.drain(from_parent)
+                os.write(sync_to_parent,
+                         WORKER_TERMINATED + EXIT_STATUS.pack(status))
                 continue
+            gc.enable()
             result = os.getpid()
         elif isinstance(result, GeneratorType):
-            for item in result:
-                pickle.dump(item, to_parent, 2)
-                to_parent.flush()
-            result = StopIteration
-        pickle.dump(result, to_parent, 2)
-        to_parent.flush()
+            send_items(result, to_parent)
+            continue
+        to_parent.write(frame([result]))
+
+def set_batch_size(items):
+    """Send batches of at most `items` items; 1 sends each item at once."""
+    global BATCH_ITEMS
+    BATCH_ITEMS = items
+
+class Tally(int):
+    """A count, which is added to a Tally just before it in its batch."""
+
+class Announcement(str):
+    """A name the parent must see at once, like that of a test starting."""
+
+class Batcher(object):
+    """Send items to the parent in batches, using a thread for deadlines."""
+
+    def __init__(self, to_parent):
+        self.to_parent = to_parent
+        self.batch = []
+        self.deadline = None
+        self.finished = False
+        self.condition = threading.Condition(threading.Lock())
+        self.thread = threading.Thread(target=self.send_when_due)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, item):
+        """Add `item` to the batch, sending it if the batch is full."""
+        with self.condition:
+            batch = self.batch
+            if isinstance(item, Tally) and batch and isinstance(batch[-1],
+                                                                Tally):
+                batch[-1] = Tally(batch[-1] + item)
+            else:
+                batch.append(item)
+            if self.deadline is None:
+                self.deadline = time() + BATCH_SECONDS
+                self.condition.notify()
+            if len(batch) >= BATCH_ITEMS or isinstance(item, Announcement):
+                self.send()
+
+    def send(self):
+        """Send the batch; the caller must hold the condition."""
+        self.to_parent.write(frame(self.batch))
+        self.batch = []
+        self.deadline = None
+
+    def send_when_due(self):
+        """Send each batch once its oldest item has waited long enough."""
+        with self.condition:
+            while not self.finished:
+                if self.deadline is None:
+                    self.condition.wait()
+                    continue
+                delay = self.deadline - time()
+                if delay > 0:
+                    self.condition.wait(delay)
+                else:
+                    self.send()
+
+    def finish(self):
+        """Send the final batch, ending with StopIteration."""
+        with self.condition:
+            self.finished = True
+            self.batch.append(StopIteration)
+            self.send()
+            self.condition.notify()
+        self.thread.join()
+
+def send_items(generator, to_parent):
+    """Send the items of `generator` to the parent in batches."""
+    batcher = Batcher(to_parent)
+    for item in generator:
+        batcher.add(item)
+    batcher.finish()
+
+def listen(address):
+    """Accept connections from remote parents, serving each in a subprocess.
+
+    This is how to start a worker agent on a machine that should run
+    tests on behalf of an Assay process elsewhere, which connects once
+    for each worker that it wants.  Commands are pickles, so anyone who
+    gets through the challenge can make the agent run arbitrary code:
+    the agent refuses to listen anywhere but on a Unix socket or the
+    loopback interface, like the bare ``':port'``, unless a secret is set.
+
+    """
+    family, address = parse_address(address)
+    secret = read_secret()
+    host = None if family == socket.AF_UNIX else address[0]
+    if host is not None and not secret and not is_loopback(host):
+        raise ValueError('refusing to listen on {0} without a secret in'
+                         ' the environment variable {1}'
+                         .format(host, SECRET_VARIABLE))
+    server = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_UNIX:
+        # Only rename the socket into place once it is listening, so a
+        # client that sees the path never has its connection refused.
+        temporary_path = '{0}.{1}'.format(address, os.getpid())
+        server.bind(temporary_path)
+        server.listen(64)
+        os.rename(temporary_path, address)
+    else:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(address)
+        server.listen(64)
+    while True:
+        connection, client_address = server.accept()
+        pid = os.fork()
+        if not pid:
+            server.close()
+            try:
+                serve_connection(connection, secret)
+            finally:
+                os._exit(0)
+        connection.close()
+        try:
+            while os.waitpid(-1, os.WNOHANG)[0]:
+                pass
+        except OSError:
+            pass
+
+def serve_connection(connection, secret):
+    """Relay commands from a remote parent to a local worker, and back."""
+    fd = connection.fileno()
+    try:
+        deliver_challenge(fd, secret)
+        answer_challenge(fd, secret)
+    except (AuthenticationError, EOFError, OSError):
+        return
+    worker = Worker()
+    poller = unix.EPoll()
+    poller.register(worker)
+    poller.register(worker.exit_pipe)
+    poller.register(connection)
+    try:
+        for source, flags in poller.events():
+            if source is worker.exit_pipe:
+                items = worker.reap()
+                if items:
+                    write_message(fd, items)
+                continue
+            if source is worker:
+                items = worker.next_batch()
+                if items:
+                    write_message(fd, items)
+                continue
+            try:
+                message = read_message(fd)
+            except EOFError:
+                return
+            if message == PUSH:
+                worker.push()
+                write_message(fd, [worker.pids[-1]])
+            elif message == POP:
+                worker.pop()
+                write_message(fd, POPPED)
+            else:
+                write_message(worker.to_worker, message)
+    finally:
+        worker.close()
 
 if __name__ == '__main__':
+    # Run the copy of this module that pickled functions refer to, so
+    # that a call like set_batch_size() changes the code that is running.
+    from assay import worker
+    # Every test runs in a fresh fork, which should find the runner and
+    # the assertion machinery already imported, wherever Assay lives.
+    from importlib import import_module
+    import_module('assay.runner')
     try:
-        worker_process(int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]))
+        if sys.argv[1] == '--listen':
+            try:
+                worker.listen(sys.argv[2])
+            except ValueError as e:
+                sys.exit('assay.worker: {0}'.format(e))
+        else:
+            worker.worker_process(*[int(arg) for arg in sys.argv[1:]])
     except KeyboardInterrupt:
         pass